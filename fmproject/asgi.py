@@ -0,0 +1,21 @@
+"""
+ASGI config for ssoproject project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The OAuth callbacks are handled with asyncio; everything else is passed to
+the WSGI application on a thread pool.  See sso/asgi.py.
+
+Run it with any ASGI server, e.g.
+
+    $ uvicorn fmproject.asgi:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fmproject.settings")
+
+from sso.asgi import AsgiHandler
+
+application = AsgiHandler(get_wsgi_application())
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 
 import os
 
+from sso.db import database_config
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -41,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'sso.metrics.MetricsMiddleware',
+    'sso.profiling.ProfilerMiddleware',
+    'sso.db.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +79,52 @@ WSGI_APPLICATION = 'fmproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
+# DATABASE_URL picks the database (SQLite in the project directory unless
+# set), and DATABASE_REPLICA_URLS, comma-separated, any read replicas.
+# Connections are kept open for DB_CONN_MAX_AGE seconds.  See sso/db.py.
+CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    'default': database_config(
+        os.environ.get('DATABASE_URL',
+                       'sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3')),
+        CONN_MAX_AGE),
 }
 
+SSO_REPLICAS = []
+for i, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = dict(database_config(url, CONN_MAX_AGE),
+                            TEST={'MIRROR': 'default'})
+    SSO_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['sso.db.ReplicaRouter']
+
+# Models whose reads may go to a replica.
+SSO_REPLICA_MODELS = ['sso.member', 'sso.verifyemail', 'sessions.session']
+
+# Seconds a client keeps reading from the primary after it writes.
+SSO_REPLICA_LAG = 5
+
+# Applied to every new SQLite connection.
+SSO_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/1.9/topics/http/sessions/
+
+# Sessions are kept either in the database ('db') or in a signed cookie with
+# a server-side revocation list ('signed'); see sso/sessions.py.
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'signed': 'sso.sessions',
+}[os.environ.get('SSO_SESSIONS', 'db')]
+SSO_SESSION_REVOCATION_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -88,6 +132,64 @@ DATABASES = {
 AUTH_USER_MODEL = 'sso.Member'
 LOGIN_URL = '/signin'
 
+# The signed-in member is looked up from a cache rather than the database on
+# each request.  See sso/backends.py for the SSO_MEMBER_CACHE options.
+AUTHENTICATION_BACKENDS = ['sso.backends.CachedModelBackend']
+SSO_MEMBER_CACHE = {
+    'BACKEND': 'local',
+    'TTL': 60,
+}
+
+# Password hashing policy.  The first hasher is used for new hashes; the rest
+# are only used to check old ones, which are upgraded when the member next
+# signs in.  See sso/hashers.py, and run `manage.py bench_hashers` to size
+# the work factor.
+SSO_PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': int(os.environ.get('SSO_PBKDF2_ITERATIONS', 24000)),
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+}
+
+PASSWORD_HASHERS = [
+    'sso.hashers.PBKDF2PasswordHasher',
+    'sso.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+if os.environ.get('SSO_PASSWORD_HASHER') == 'scrypt':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+# Run password hashing in a bounded process pool, returning 503 when it's
+# saturated.  See sso/hashpool.py.
+SSO_HASH_POOL = {
+    'ENABLED': os.environ.get('SSO_HASH_POOL') == 'on',
+    'PROCESSES': None,
+    'MAX_QUEUE': 32,
+    'TIMEOUT': 10,
+}
+
+# Who may read /metrics (see sso/metrics.py), by the same client address the
+# rate limits use.
+SSO_METRICS_ALLOWED_IPS = os.environ.get('SSO_METRICS_ALLOWED_IPS',
+                                         '127.0.0.1,::1').split(',')
+
+# Sample the stacks of slow requests into DIR, for flame graphs.
+# Off unless SSO_PROFILER=on.  See sso/profiling.py.
+SSO_PROFILER = {
+    'ENABLED': os.environ.get('SSO_PROFILER') == 'on',
+    'THRESHOLD': 0.5,
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+}
+
+# Sign-in and sign-up rate limits.  See sso/ratelimit.py for the defaults.
+SSO_RATE_LIMIT = {
+    'BACKEND': 'local',
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,6 +205,24 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Email verify tokens are either random strings stored in the VerifyEmail
+# table ('db'), or signed values that need no database access ('signed').
+SSO_VERIFY_TOKENS = os.environ.get('SSO_VERIFY_TOKENS', 'db')
+
+# Random tokens are generated this many at a time and handed out from a pool.
+SSO_TOKEN_POOL_SIZE = 256
+
+# Base URLs for the OAuth providers, e.g. to point them at a local stub
+# server ({'github': 'http://127.0.0.1:9000', ...}).  See sso/providers.py
+# for the names and for the connection pool and timeout options that can
+# be set in SSO_PROVIDER_HTTP.
+SSO_PROVIDER_URLS = {}
+SSO_PROVIDER_HTTP = {}
+
+# Fail provider calls fast while a provider is erroring or slow, instead of
+# tying up workers.  See sso/breaker.py for the defaults.
+SSO_CIRCUIT_BREAKER = {}
+
 # Display email on the console for testing
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
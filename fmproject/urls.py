@@ -26,6 +26,7 @@ urlpatterns = [
     url(r'^signup$', views.signup, name='signup'),
     url(r'^verify$', views.verify, name='verify'),
     url(r'^welcome$', views.welcome, name='welcome'),
+    url(r'^metrics$', views.metrics_view, name='metrics'),
     url(r'^callback/github$', views.auth_with_github, name='auth_with_github'),
     url(r'^callback/facebook$', views.auth_with_facebook, name='auth_with_facebook'),
     url(r'^callback/google$', views.auth_with_google, name='auth_with_google'),
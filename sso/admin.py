@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
@@ -18,6 +19,14 @@ class MemberCreationForm(forms.ModelForm):
         model = Member
         fields = ('email', 'full_name', 'short_name')
 
+    def clean_email(self):
+        # Member.email is unique as typed; this catches the same address in
+        # a different case, which email_key's unique index would reject.
+        email = self.cleaned_data['email']
+        if Member.objects.is_registered(email):
+            raise forms.ValidationError("That email address is already registered.")
+        return email
+
     def clean_password2(self):
         # Check that the two password entries match
         password1 = self.cleaned_data.get("password1")
@@ -47,6 +56,13 @@ class MemberChangeForm(forms.ModelForm):
         fields = ('email', 'password', 'full_name', 'short_name',
             'is_active', 'is_admin')
 
+    def clean_email(self):
+        # As in MemberCreationForm, but the member may keep their own address.
+        email = self.cleaned_data['email']
+        if Member.objects.exclude(pk=self.instance.pk).is_registered(email):
+            raise forms.ValidationError("That email address is already registered.")
+        return email
+
     def clean_password(self):
         # Regardless of what the user provides, return the initial value.
         # This is done here, rather than on the field, because the
@@ -54,6 +70,69 @@ class MemberChangeForm(forms.ModelForm):
         return self.initial["password"]
 
 
+class KeysetChangeList(ChangeList):
+    """
+    A changelist that pages by email_key instead of by page number.
+
+    The stock changelist runs COUNT(*) and then OFFSET n on every page, both
+    of which read through the whole table, so pages get slower the further
+    in they are.  Here each page is WHERE email_key > (the last key on the
+    previous page) ORDER BY email_key LIMIT n, which is an index range scan
+    whatever the page, and nothing is counted: there are just next and
+    previous links.  Rows are always ordered by email; sorting by other
+    columns is ignored.
+    """
+    AFTER_VAR = 'after'
+    BEFORE_VAR = 'before'
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(KeysetChangeList, self).get_filters_params(params)
+        lookup_params.pop(self.AFTER_VAR, None)
+        lookup_params.pop(self.BEFORE_VAR, None)
+        return lookup_params
+
+    def get_ordering(self, request, queryset):
+        return ['email_key']
+
+    def get_results(self, request):
+        per_page = self.list_per_page
+        after = self.params.get(self.AFTER_VAR)
+        before = self.params.get(self.BEFORE_VAR)
+
+        # Fetch one extra row to find out whether there's another page.
+        if before is not None:
+            rows = list(self.queryset.filter(email_key__lt=before)
+                        .order_by('-email_key')[:per_page + 1])
+            has_previous, has_next = len(rows) > per_page, True
+            rows = rows[:per_page][::-1]
+        else:
+            queryset = self.queryset
+            if after is not None:
+                queryset = queryset.filter(email_key__gt=after)
+            rows = list(queryset.order_by('email_key')[:per_page + 1])
+            has_previous, has_next = after is not None, len(rows) > per_page
+            rows = rows[:per_page]
+
+        remove = [self.AFTER_VAR, self.BEFORE_VAR]
+        self.next_url = self.previous_url = None
+        if rows and has_next:
+            self.next_url = self.get_query_string(
+                {self.AFTER_VAR: rows[-1].email_key}, remove)
+        if rows and has_previous:
+            self.previous_url = self.get_query_string(
+                {self.BEFORE_VAR: rows[0].email_key}, remove)
+        self.first_url = self.get_query_string(remove=remove)
+
+        self.result_list = rows
+        self.result_count = len(rows)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = has_previous or has_next
+        self.paginator = None
+
+
 class MemberAdmin(UserAdmin):
     # The forms to add and change user instances
     form = MemberChangeForm
@@ -78,8 +157,20 @@ class MemberAdmin(UserAdmin):
         ),
     )
     search_fields = ('email',)
-    ordering = ('email',)
+    ordering = ('email_key',)
     filter_horizontal = ()
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # Search is by email prefix through the email_key index, rather than
+        # the default icontains, which has to scan the whole table.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.with_email_prefix(search_term), False
 
 # Now register the new MemberAdmin...
 admin.site.register(Member, MemberAdmin)
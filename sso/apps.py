@@ -1,21 +1,37 @@
-import json
-import os.path
+import signal
 from django.apps import AppConfig
-from fmproject import settings
+from .conf import provider_config, provider_setting
 
 
 class SsoConfig(AppConfig):
-    base_config = json.load(
-        open(os.path.join(settings.BASE_DIR, 'fmproject', 'config.json'))
-    )
     name = 'sso'
 
-    github_client_id = base_config['github']['client_id']
-    github_client_secret = base_config['github']['client_secret']
+    # Provider credentials are loaded on first use; see sso/conf.py.
+    github_client_id = provider_setting('github', 'client_id')
+    github_client_secret = provider_setting('github', 'client_secret')
 
-    google_client_id = base_config['google']['client_id']
-    google_client_secret = base_config['google']['client_secret']
+    google_client_id = provider_setting('google', 'client_id')
+    google_client_secret = provider_setting('google', 'client_secret')
 
-    facebook_client_id = base_config['facebook']['client_id']
-    facebook_client_secret = base_config['facebook']['client_secret']
+    facebook_client_id = provider_setting('facebook', 'client_id')
+    facebook_client_secret = provider_setting('facebook', 'client_secret')
 
+    def ready(self):
+        from . import signals  # noqa: connects the handlers
+
+        # Reload provider config on SIGHUP.  Only the main thread can set
+        # signal handlers, and a server's own handler is kept and chained.
+        try:
+            previous = signal.getsignal(signal.SIGHUP)
+        except (AttributeError, ValueError):
+            return
+
+        def reload_config(signum, frame):
+            provider_config.reload()
+            if callable(previous):
+                previous(signum, frame)
+
+        try:
+            signal.signal(signal.SIGHUP, reload_config)
+        except ValueError:
+            pass
@@ -0,0 +1,273 @@
+"""
+An ASGI front end for the site (see fmproject/asgi.py).
+
+The OAuth callbacks spend nearly all their time waiting on the provider, so
+here the provider exchanges are done with asyncio and aiohttp: one process
+can have thousands of them in flight.  Once the provider has answered, the
+request is handed to the ordinary Django WSGI application on a thread pool,
+with the result attached as environ['sso.provider_result'], and the usual
+view (see views.provider_result) signs the member in without any further
+network calls -- unless it's a GitHub account seen for the first time, when
+the view looks up its verified email itself.  Every other URL goes straight
+to the thread pool.
+"""
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from urllib.parse import parse_qs
+import aiohttp
+import requests
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from . import breaker, jwks, metrics, providers
+from . import views
+
+
+class AsyncProviders(object):
+    """
+    The asyncio counterpart of sso.providers: one pooled aiohttp session per
+    provider, with the same timeouts, retry rules and base URLs.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def session(self, provider):
+        if provider not in self._sessions:
+            options = providers.http_options()
+            self._sessions[provider] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=options['ASYNC_POOL_SIZE']),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=options['CONNECT_TIMEOUT'],
+                    sock_read=options['READ_TIMEOUT']))
+        return self._sessions[provider]
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions = {}
+
+    async def request(self, provider, method, url, **kwargs):
+        circuit = breaker.circuit(provider)
+        token = circuit.before_call()
+        ok = False
+        start = time.perf_counter()
+        try:
+            result = await self._request(provider, method, url, **kwargs)
+            ok = True
+            return result
+        except aiohttp.ClientResponseError as e:
+            # A 4xx is the request's fault, not the provider's.
+            ok = e.status < 500
+            raise
+        finally:
+            circuit.record(token, ok, time.perf_counter() - start)
+
+    async def _request(self, provider, method, url, **kwargs):
+        options = providers.http_options()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with self.session(provider).request(method, url, **kwargs) as r:
+                    metrics.http_request_seconds.observe(
+                        time.perf_counter() - start, provider, r.status)
+                    # As with the sync sessions, gateway errors are retried
+                    # for GET only.
+                    if not (method == 'GET' and r.status in (502, 503, 504)
+                            and attempt < options['RETRIES']):
+                        r.raise_for_status()
+                        return await r.json(content_type=None)
+            except aiohttp.ClientConnectorError:
+                metrics.http_request_seconds.observe(
+                    time.perf_counter() - start, provider, 'error')
+                if attempt >= options['RETRIES']:
+                    raise
+            attempt += 1
+            await asyncio.sleep(options['BACKOFF'] * 2 ** (attempt - 1))
+
+    async def access_token(self, provider, url, payload):
+        return await self.request(provider, 'POST', url, data=payload,
+                                  headers={'Accept': 'application/json'})
+
+    async def fetch_github_identity(self, code):
+        json_resp = await self.access_token(
+            'github',
+            providers.provider_url('github', '/login/oauth/access_token'),
+            views.github_token_payload(code))
+        token = json_resp['access_token']
+        user = await self.request(
+            'github', 'GET', providers.provider_url('github_api', '/user'),
+            params={'access_token': token})
+        return views.github_identity(user, token)
+
+    async def fetch_google_identity(self, code):
+        # Discovery and key lookups are cached and only rarely block on the
+        # network, but that's still too much for the event loop, so they run
+        # on the default executor.
+        loop = asyncio.get_event_loop()
+        token_endpoint = await loop.run_in_executor(
+            None, jwks.google_token_endpoint)
+        json_resp = await self.access_token(
+            'google', token_endpoint, views.google_token_payload(code))
+        claims = await loop.run_in_executor(
+            None, views.verify_google_id_token, json_resp['id_token'])
+        return views.google_identity(claims)
+
+    async def fetch_facebook_identity(self, code):
+        json_resp = await self.access_token(
+            'facebook',
+            providers.provider_url('facebook', '/v2.6/oauth/access_token'),
+            views.facebook_token_payload(code))
+        profile = await self.request(
+            'facebook', 'GET', providers.provider_url('facebook', '/v2.6/me'),
+            params={'fields': views.FACEBOOK_PROFILE_FIELDS,
+                    'access_token': json_resp['access_token']})
+        return views.facebook_identity(profile)
+
+
+class AsgiHandler(object):
+    """
+    An ASGI 3 application wrapping a WSGI application.
+    """
+
+    def __init__(self, wsgi_application, max_threads=20):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_threads)
+        self.providers = AsyncProviders()
+        self.callbacks = {
+            '/callback/github': self.providers.fetch_github_identity,
+            '/callback/google': self.providers.fetch_google_identity,
+            '/callback/facebook': self.providers.fetch_facebook_identity,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.providers.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        environ = self.environ(scope, body)
+
+        loop = asyncio.get_event_loop()
+        fetch = self.callbacks.get(scope['path'])
+        code = parse_qs(environ['QUERY_STRING']).get('code', [''])[0]
+        if fetch is not None and code:
+            # As in the sync views, the state is checked before the code is
+            # spent on the provider.  Loading the session may block.
+            valid = await loop.run_in_executor(
+                self.executor, self.valid_oauth_state, environ)
+            if not valid:
+                response = views.invalid_oauth_state()
+                await self.respond(send, '%d %s' % (response.status_code,
+                                                    response.reason_phrase),
+                                   list(response.items()), [response.content])
+                return
+            try:
+                environ['sso.provider_result'] = await fetch(code)
+            except requests.RequestException as e:
+                # Google discovery and key fetches (run on the executor), or
+                # an open circuit (see breaker.py).
+                response = views.provider_unavailable(e)
+                await self.respond(send, '%d %s' % (response.status_code,
+                                                    response.reason_phrase),
+                                   list(response.items()), [response.content])
+                return
+            except jwks.InvalidIdToken:
+                await self.respond(send, '400 Bad Request',
+                                   [('Content-Type', 'application/json')],
+                                   [b'{"error": "Invalid ID token"}'])
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+                await self.respond(send, '502 Bad Gateway',
+                                   [('Content-Type', 'application/json')],
+                                   [b'{"error": "Provider unavailable"}'])
+                return
+
+        status, headers, chunks = await loop.run_in_executor(
+            self.executor, self.run_wsgi, environ)
+        await self.respond(send, status, headers, chunks)
+
+    def valid_oauth_state(self, environ):
+        request = WSGIRequest(environ)
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        return views.valid_oauth_state(request)
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = 'HTTP_' + name
+                if key in environ:
+                    value = environ[key] + ',' + value
+                environ[key] = value
+        return environ
+
+    def run_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+    async def respond(self, send, status, headers, chunks):
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
@@ -0,0 +1,80 @@
+"""
+Authentication backends.
+
+The authentication middleware looks up the signed-in member on every
+request.  CachedModelBackend serves that lookup from a cache instead of the
+database.  settings.SSO_MEMBER_CACHE picks the cache:
+
+    SSO_MEMBER_CACHE = {
+        'BACKEND': 'local',     # or the name of a cache in settings.CACHES
+        'TTL': 60,              # seconds
+        'MAX_SIZE': 10000,      # members (local cache only)
+    }
+
+Entries are dropped whenever a Member is saved or deleted (see signals.py),
+which covers password changes and is_active being switched off.  A local
+cache only sees saves made in its own process, so with several worker
+processes other workers may serve a stale member for up to TTL seconds.
+Use a shared cache if that matters.  QuerySet.update() sends no signals and
+so doesn't invalidate anything.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import router
+from .cache import LocalLRUCache
+
+
+DEFAULT_MEMBER_CACHE = {
+    'BACKEND': 'local',
+    'TTL': 60,
+    'MAX_SIZE': 10000,
+}
+
+_local_cache = None
+
+
+def member_cache_options():
+    options = DEFAULT_MEMBER_CACHE.copy()
+    options.update(getattr(settings, 'SSO_MEMBER_CACHE', {}))
+    return options
+
+
+def member_cache():
+    global _local_cache
+    options = member_cache_options()
+    if options['BACKEND'] != 'local':
+        return caches[options['BACKEND']]
+    if _local_cache is None:
+        _local_cache = LocalLRUCache(options['MAX_SIZE'], options['TTL'])
+    return _local_cache
+
+
+def member_cache_key(member_id):
+    return 'sso.member.%s' % member_id
+
+
+def invalidate_member(member_id):
+    member_cache().delete(member_cache_key(member_id))
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        Member = get_user_model()
+        fields = [f.attname for f in Member._meta.concrete_fields]
+        key = member_cache_key(user_id)
+        cache = member_cache()
+
+        # The cache holds plain field values rather than the instance, so
+        # each request gets its own Member object.
+        values = cache.get(key)
+        if values is not None:
+            return Member.from_db(router.db_for_read(Member), fields, values)
+
+        member = super(CachedModelBackend, self).get_user(user_id)
+        if member is not None:
+            cache.set(key, tuple(getattr(member, f) for f in fields),
+                      member_cache_options()['TTL'])
+        return member
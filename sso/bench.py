@@ -0,0 +1,89 @@
+"""
+Helpers shared by the bench_* management commands.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from django.db import connection, connections, transaction
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def scratch_transaction():
+    """
+    Runs the block inside a transaction that is always rolled back, so that
+    benchmarks can seed and mangle data without leaving anything behind.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """
+    Runs the block on a freshly migrated database in a temporary file, which
+    is thrown away afterwards.  For benchmarks whose requests run on other
+    threads, which scratch_transaction() can't cover: each thread has its
+    own connection.  (A file rather than memory, so that they all see the
+    same one.)
+    """
+    settings_dict = connection.settings_dict
+    saved = dict(settings_dict)
+    with tempfile.TemporaryDirectory() as dir:
+        # Server threads exit after each request, so don't leave their
+        # connections open.
+        settings_dict['CONN_MAX_AGE'] = 0
+        if connection.vendor == 'sqlite':
+            settings_dict['TEST'] = dict(settings_dict.get('TEST') or {},
+                                         NAME=os.path.join(dir, 'bench.db'))
+        old_name = connection.creation.create_test_db(
+            verbosity=verbosity, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+            settings_dict.update(saved)
+
+
+def timed(fn, repeat=1):
+    """
+    Calls fn() repeat times and returns the list of durations in seconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    """
+    Returns the pct'th percentile (0-100) of samples, nearest rank.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(samples):
+    """
+    Formats a list of durations (seconds) as a one-line latency summary.
+    """
+    if not samples:
+        return 'no samples'
+    mean = sum(samples) / len(samples)
+    return 'mean %.3fms  p50 %.3fms  p99 %.3fms  max %.3fms  (n=%d)' % (
+        mean * 1000, percentile(samples, 50) * 1000,
+        percentile(samples, 99) * 1000, max(samples) * 1000, len(samples))
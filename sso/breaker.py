@@ -0,0 +1,220 @@
+"""
+A circuit breaker per OAuth provider.
+
+When a provider is down or crawling, every callback would otherwise wait out
+its timeouts, until all the workers are stuck waiting and password sign-in
+goes down with it.  So each provider's calls go through a CircuitBreaker
+(see providers.request() and asgi.AsyncProviders.request()), which keeps
+the outcomes of the last WINDOW seconds of calls:
+
+- closed: calls go through.  Once at least MIN_CALLS have been made in the
+  window, and ERROR_RATE of them failed (a connection error, timeout or 5xx)
+  or SLOW_RATE of them took longer than SLOW_CALL seconds, it opens.
+- open: calls fail at once with CircuitOpen, and the views answer with a
+  503 telling the member to try again later or use their password.  After
+  OPEN_SECONDS it goes half-open.
+- half-open: up to PROBES calls go through to test the provider.  A good
+  one closes the circuit; a failed or slow one opens it again.
+
+settings.SSO_CIRCUIT_BREAKER overrides the defaults below.  The state is
+per process, shared by its threads, and exported on /metrics.
+"""
+import threading
+import time
+import requests
+from django.conf import settings
+from . import metrics
+
+
+DEFAULT_CIRCUIT_BREAKER = {
+    'WINDOW': 30,
+    'MIN_CALLS': 20,
+    'ERROR_RATE': 0.5,
+    'SLOW_CALL': 5.0,
+    'SLOW_RATE': 0.5,
+    'OPEN_SECONDS': 30,
+    'PROBES': 1,
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(requests.ConnectionError):
+    """
+    Raised instead of calling a provider whose circuit is open.  It's a
+    requests.ConnectionError so that code already handling a provider being
+    unreachable handles this too.
+    """
+
+    def __init__(self, name, retry_after):
+        super(CircuitOpen, self).__init__('%s is unavailable (circuit open)' % name)
+        self.name = name
+        self.retry_after = retry_after
+
+
+def breaker_options():
+    options = DEFAULT_CIRCUIT_BREAKER.copy()
+    options.update(getattr(settings, 'SSO_CIRCUIT_BREAKER', {}))
+    return options
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, window=30, min_calls=20, error_rate=0.5,
+                 slow_call=5.0, slow_rate=0.5, open_seconds=30, probes=1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._state = CLOSED
+        # Bumped on every change of state, so that record() can tell calls
+        # admitted under an earlier one.
+        self._generation = 0
+        self._opened_at = 0
+        self._probing = 0
+        # One [second, calls, errors, slow] bucket per second of the window.
+        self._buckets = [[0, 0, 0, 0] for _ in range(window)]
+        self._counts = {'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._generation += 1
+            self._probing = 0
+        return self._state
+
+    def before_call(self):
+        """
+        Raises CircuitOpen if the call shouldn't be made.  Otherwise returns
+        a token, which the caller must pass to record() with how it went.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return (self._generation, False)
+            if state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return (self._generation, True)
+            self._counts['rejected'] += 1
+            retry_after = self.open_seconds - (now - self._opened_at)
+        raise CircuitOpen(self.name, max(int(retry_after + 0.999), 1))
+
+    def record(self, token, ok, elapsed):
+        """
+        Records the outcome of the call before_call() gave token for: ok is
+        False if it failed, and it took elapsed seconds.
+        """
+        generation, probe = token
+        slow = elapsed >= self.slow_call
+        with self._lock:
+            now = time.monotonic()
+            self._current_state(now)
+            if generation != self._generation:
+                # Admitted before the state last changed, e.g. a call that
+                # was already in flight when the circuit opened; it says
+                # nothing about the provider now.
+                return
+            if probe:
+                self._probing -= 1
+                if ok and not slow:
+                    self._close()
+                else:
+                    self._open(now)
+                return
+
+            second = int(now)
+            bucket = self._buckets[second % self.window]
+            if bucket[0] != second:
+                bucket[:] = [second, 0, 0, 0]
+            bucket[1] += 1
+            bucket[2] += not ok
+            bucket[3] += slow
+
+            calls = errors = slows = 0
+            for start, bucket_calls, bucket_errors, bucket_slow in self._buckets:
+                if second - start < self.window:
+                    calls += bucket_calls
+                    errors += bucket_errors
+                    slows += bucket_slow
+            if calls >= self.min_calls and (errors >= self.error_rate * calls or
+                                            slows >= self.slow_rate * calls):
+                self._open(now)
+
+    def _open(self, now):
+        self._state = OPEN
+        self._generation += 1
+        self._opened_at = now
+        self._counts['opened'] += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._generation += 1
+        for bucket in self._buckets:
+            bucket[:] = [0, 0, 0, 0]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, state=self._current_state(time.monotonic()))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit(name):
+    """
+    Returns the shared CircuitBreaker for the named provider.
+    """
+    try:
+        return _breakers[name]
+    except KeyError:
+        pass
+
+    with _breakers_lock:
+        if name not in _breakers:
+            options = breaker_options()
+            _breakers[name] = CircuitBreaker(
+                name, options['WINDOW'], options['MIN_CALLS'],
+                options['ERROR_RATE'], options['SLOW_CALL'],
+                options['SLOW_RATE'], options['OPEN_SECONDS'], options['PROBES'])
+        return _breakers[name]
+
+
+def reset():
+    """
+    Forgets every breaker's state, e.g. after a settings change.
+    """
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def collect_metrics():
+    """
+    Reports the breakers on /metrics (see metrics.py).
+    """
+    stats = sorted((name, breaker.stats()) for name, breaker in list(_breakers.items()))
+    if not stats:
+        return
+    yield ('sso_circuit_state', 'gauge',
+           'Provider circuit state: 0 closed, 1 half-open, 2 open.',
+           [({'provider': name}, STATE_VALUES[s['state']]) for name, s in stats])
+    yield ('sso_circuit_opened_total', 'counter', 'Times the circuit opened.',
+           [({'provider': name}, s['opened']) for name, s in stats])
+    yield ('sso_circuit_rejected_total', 'counter',
+           'Calls refused while the circuit was open.',
+           [({'provider': name}, s['rejected']) for name, s in stats])
+
+
+metrics.registry.register_collector(collect_metrics)
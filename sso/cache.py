@@ -0,0 +1,83 @@
+"""
+A small in-process cache with least-recently-used eviction and a TTL.
+
+It has the same get/set/delete interface as a Django cache, so code can use
+either one of these or a shared cache from settings.CACHES interchangeably.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalLRUCache(object):
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                return default
+            if expires < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        missing = object()
+        values = ((key, self.get(key, missing)) for key in keys)
+        return {key: value for key, value in values if value is not missing}
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def _set(self, key, value, timeout):
+        expires = time.time() + (self.ttl if timeout is None else timeout)
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] >= time.time()
+
+    def add(self, key, value, timeout=None):
+        """
+        Sets the key only if it isn't already set.  Returns True if it was.
+        """
+        with self._lock:
+            if self._live(key):
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def incr(self, key, delta=1):
+        """
+        Adds delta to the key's value, keeping its expiry time.  Raises
+        ValueError if the key isn't set.
+        """
+        with self._lock:
+            if not self._live(key):
+                raise ValueError("Key '%s' not found" % key)
+            value, expires = self._entries[key]
+            self._entries[key] = (value + delta, expires)
+            return value + delta
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
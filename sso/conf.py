@@ -0,0 +1,95 @@
+"""
+OAuth provider credentials.
+
+Each provider's client_id and client_secret come from the environment
+(e.g. SSO_GITHUB_CLIENT_ID) or, failing that, from fmproject/config.json
+(see config.json.example).  Nothing is read at import time: the config is
+loaded and validated on first use and then cached.  Sending the process
+SIGHUP makes it reload on next use, so credentials can be rotated without
+restarting workers.
+"""
+import json
+import os
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+PROVIDERS = ('github', 'google', 'facebook')
+FIELDS = ('client_id', 'client_secret')
+
+
+def config_path():
+    return getattr(settings, 'SSO_CONFIG_FILE',
+                   os.path.join(settings.BASE_DIR, 'fmproject', 'config.json'))
+
+
+class ProviderConfig(object):
+
+    def __init__(self):
+        self._config = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Reads and validates the config.  A missing file is fine, and leaves
+        any provider not set in the environment unconfigured ('').
+        """
+        path = config_path()
+        try:
+            with open(path) as f:
+                base_config = json.load(f)
+        except FileNotFoundError:
+            base_config = {}
+        except ValueError as e:
+            raise ImproperlyConfigured('%s is not valid JSON: %s' % (path, e))
+        if not isinstance(base_config, dict):
+            raise ImproperlyConfigured('%s should hold a JSON object' % path)
+
+        config = {}
+        for provider in PROVIDERS:
+            section = base_config.get(provider, {})
+            if not isinstance(section, dict):
+                raise ImproperlyConfigured(
+                    '"%s" in %s should be an object' % (provider, path))
+            config[provider] = {}
+            for field in FIELDS:
+                env = 'SSO_%s_%s' % (provider.upper(), field.upper())
+                value = os.environ.get(env, section.get(field, ''))
+                if not isinstance(value, str):
+                    raise ImproperlyConfigured(
+                        '%s.%s in %s should be a string' % (provider, field, path))
+                config[provider][field] = value
+        return config
+
+    def get(self, provider, field):
+        config = self._config
+        if config is None:
+            with self._lock:
+                if self._config is None:
+                    self._config = self.load()
+                config = self._config
+        return config[provider][field]
+
+    def reload(self):
+        """
+        Drops the cached config so that it's read again on next use.
+        """
+        self._config = None
+
+
+provider_config = ProviderConfig()
+
+
+class provider_setting(object):
+    """
+    A class attribute that reads through to provider_config, so that
+    SsoConfig.github_client_id and friends stay lazy.
+    """
+
+    def __init__(self, provider, field):
+        self.provider = provider
+        self.field = field
+
+    def __get__(self, instance, owner):
+        return provider_config.get(self.provider, self.field)
@@ -0,0 +1,97 @@
+"""
+Password hashers whose work factor is set per deployment.
+
+settings.SSO_PASSWORD_HASHING holds the parameters, and the first entry of
+PASSWORD_HASHERS picks the algorithm (see settings.py).  Changing either one
+is safe: existing hashes still verify, and Django rehashes a member's
+password with the current policy the next time they sign in.
+
+Use the bench_hashers management command to see what a setting costs.
+"""
+import base64
+import hashlib
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+from django.utils.translation import ugettext_noop as _
+
+
+DEFAULT_PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': hashers.PBKDF2PasswordHasher.iterations,
+    # scrypt costs about 128 * N * R bytes of memory per hash (16MB here).
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+}
+
+
+def hashing_options():
+    options = DEFAULT_PASSWORD_HASHING.copy()
+    options.update(getattr(settings, 'SSO_PASSWORD_HASHING', {}))
+    return options
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the iteration count taken from
+    settings.  It uses the same algorithm name, so it reads existing hashes.
+    """
+
+    @property
+    def iterations(self):
+        return hashing_options()['PBKDF2_ITERATIONS']
+
+
+class ScryptPasswordHasher(hashers.BasePasswordHasher):
+    """
+    The memory-hard scrypt KDF.  Needs hashlib.scrypt, i.e. Python 3.6+
+    built against OpenSSL 1.1 or later.
+    """
+    algorithm = 'scrypt'
+
+    def params(self):
+        options = hashing_options()
+        return options['SCRYPT_N'], options['SCRYPT_R'], options['SCRYPT_P']
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        if not hasattr(hashlib, 'scrypt'):
+            raise ValueError("%r needs hashlib.scrypt, which this Python doesn't have"
+                             % self.__class__.__name__)
+        default_n, default_r, default_p = self.params()
+        n, r, p = n or default_n, r or default_r, p or default_p
+        hash = hashlib.scrypt(force_bytes(password), salt=force_bytes(salt),
+                              n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=64)
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return '%s$%d$%d$%d$%s$%s' % (self.algorithm, n, r, p, salt, hash)
+
+    def decode(self, encoded):
+        algorithm, n, r, p, salt, hash = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return int(n), int(r), int(p), salt, hash
+
+    def verify(self, password, encoded):
+        n, r, p, salt, hash = self.decode(encoded)
+        return constant_time_compare(encoded, self.encode(password, salt, n, r, p))
+
+    def safe_summary(self, encoded):
+        n, r, p, salt, hash = self.decode(encoded)
+        return OrderedDict([
+            (_('algorithm'), self.algorithm),
+            (_('work factor'), n),
+            (_('block size'), r),
+            (_('parallelism'), p),
+            (_('salt'), hashers.mask_hash(salt)),
+            (_('hash'), hashers.mask_hash(hash)),
+        ])
+
+    def must_update(self, encoded):
+        return self.decode(encoded)[:3] != self.params()
+
+    def harden_runtime(self, password, encoded):
+        # Parameters can change in any direction, so there's no extra work
+        # that would make up the difference.
+        pass
@@ -0,0 +1,237 @@
+"""
+Runs password hashing in a bounded pool of worker processes.
+
+Hashing is deliberately slow, and on the request thread a few concurrent
+sign-ins can tie up every worker while cheap pages wait.  With the pool on,
+Member.set_password() and Member.check_password() hand the work to a
+process pool instead, and when more than MAX_QUEUE hashes are already
+waiting they fail fast with HashPoolSaturated, which the views turn into a
+503.  settings.SSO_HASH_POOL configures it:
+
+    SSO_HASH_POOL = {
+        'ENABLED': False,
+        'PROCESSES': None,      # defaults to the number of CPUs
+        'MAX_QUEUE': 32,        # hashes waiting for a free process
+        'TIMEOUT': 10,          # seconds to wait for a result
+    }
+
+The workers are forked from the web process the first time it hashes, so
+they see the settings (including SSO_PASSWORD_HASHING) as they were then.
+stats() reports queue wait and hash times.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from django.conf import settings
+from django.contrib.auth import hashers
+from . import metrics
+
+
+DEFAULT_HASH_POOL = {
+    'ENABLED': False,
+    'PROCESSES': None,
+    'MAX_QUEUE': 32,
+    'TIMEOUT': 10,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class HashPoolSaturated(Exception):
+    """
+    Raised when the pool is too busy to take more work.
+    """
+
+
+def hash_pool_options():
+    options = DEFAULT_HASH_POOL.copy()
+    options.update(getattr(settings, 'SSO_HASH_POOL', {}))
+    return options
+
+
+def _timed(fn, *args):
+    # Runs in the worker.  time.time() rather than perf_counter() because
+    # the timestamps are compared with the parent's clock.
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time()
+
+
+def _check_password(password, encoded):
+    updated = []
+    valid = hashers.check_password(password, encoded, updated.append)
+    return valid, bool(updated)
+
+
+class HashPool(object):
+
+    def __init__(self, processes=None, max_queue=32, timeout=10):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ['completed', 'rejected', 'timeouts', 'queue_wait', 'queue_wait_max',
+             'hash_time', 'hash_time_max'], 0)
+
+    def executor(self):
+        # A forked web worker can't use its parent's pool.
+        if self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(self.processes)
+            self._pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def submit(self, fn, *args):
+        with self._lock:
+            executor = self.executor()
+            if self._pending >= self.processes + self.max_queue:
+                self._stats['rejected'] += 1
+                raise HashPoolSaturated()
+            self._pending += 1
+        future = executor.submit(_timed, fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, fn, *args):
+        """
+        Runs fn(*args) in a worker process and returns the result.
+        """
+        submitted = time.time()
+        future = self.submit(fn, *args)
+        try:
+            result, started, finished = future.result(self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise HashPoolSaturated()
+
+        wait, hash_time = max(started - submitted, 0), finished - started
+        with self._lock:
+            stats = self._stats
+            stats['completed'] += 1
+            stats['queue_wait'] += wait
+            stats['queue_wait_max'] = max(stats['queue_wait_max'], wait)
+            stats['hash_time'] += hash_time
+            stats['hash_time_max'] = max(stats['hash_time_max'], hash_time)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, pending=self._pending)
+        completed = stats['completed'] or 1
+        stats['queue_wait_avg'] = stats['queue_wait'] / completed
+        stats['hash_time_avg'] = stats['hash_time'] / completed
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = self._pid = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hash_pool():
+    """
+    Returns the shared HashPool, or None if the pool is switched off.
+    """
+    global _pool
+    options = hash_pool_options()
+    if not options['ENABLED']:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashPool(options['PROCESSES'], options['MAX_QUEUE'],
+                             options['TIMEOUT'])
+        return _pool
+
+
+def shutdown():
+    """
+    Stops the shared pool's workers.  The next hash starts a new pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+def stats():
+    pool = hash_pool()
+    return pool.stats() if pool is not None else {}
+
+
+def collect_metrics():
+    """
+    Reports the pool's stats on /metrics (see metrics.py).
+    """
+    pool = _pool
+    if pool is None:
+        return
+    stats = pool.stats()
+    yield ('sso_hash_pool_pending', 'gauge', 'Hashes running or waiting.',
+           [({}, stats['pending'])])
+    for name, help in (('completed', 'Hashes run in the pool.'),
+                       ('rejected', 'Hashes refused because the queue was full.'),
+                       ('timeouts', 'Hashes that took longer than TIMEOUT.')):
+        yield ('sso_hash_pool_%s_total' % name, 'counter', help, [({}, stats[name])])
+    yield ('sso_hash_pool_queue_wait_seconds_total', 'counter',
+           'Time hashes spent waiting for a free process.', [({}, stats['queue_wait'])])
+    yield ('sso_hash_pool_hash_seconds_total', 'counter',
+           'Time spent hashing in the pool.', [({}, stats['hash_time'])])
+
+
+metrics.registry.register_collector(collect_metrics)
+
+
+def make_password(password):
+    with metrics.timer(metrics.password_hash_seconds, 'hash', 'make'):
+        return _make_password(password)
+
+
+def _make_password(password):
+    pool = hash_pool()
+    if pool is None or password is None:
+        return hashers.make_password(password)
+    try:
+        return pool.run(hashers.make_password, password)
+    except HashPoolSaturated:
+        logger.warning('Password hashing pool is saturated')
+        raise
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Like django.contrib.auth.hashers.check_password(), but runs in the pool
+    when it's enabled.  setter(password) is called in this process if the
+    password needs rehashing.
+    """
+    with metrics.timer(metrics.password_hash_seconds, 'hash', 'check'):
+        return _check_password_in_pool(password, encoded, setter)
+
+
+def _check_password_in_pool(password, encoded, setter):
+    pool = hash_pool()
+    if pool is None:
+        return hashers.check_password(password, encoded, setter)
+    try:
+        valid, must_update = pool.run(_check_password, password, encoded)
+    except HashPoolSaturated:
+        logger.warning('Password hashing pool is saturated')
+        raise
+    if valid and must_update and setter:
+        setter(password)
+    return valid
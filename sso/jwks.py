@@ -0,0 +1,274 @@
+"""
+Local verification of Google ID tokens.
+
+Google's discovery document and signing keys (JWKS) change rarely, so they
+are fetched once and cached, and refreshed in the background shortly before
+they expire.  Verifying an ID token is then pure CPU work against the cached
+keys.  Where the keys come from is pluggable (see KeySource), so tests can
+run entirely offline with locally generated keys.
+"""
+import base64
+import json
+import re
+import threading
+import time
+import rsa
+from . import providers
+
+
+# How long to keep a document when the response doesn't say.
+DEFAULT_TTL = 3600
+
+# Start a background refresh once a document is this far through its life.
+REFRESH_AHEAD = 0.8
+
+# An unknown key id triggers an immediate refetch (Google may have rotated
+# its keys), but no more often than this many seconds.
+MIN_REFETCH_INTERVAL = 60
+
+# Allowed clock difference, in seconds, when checking token times.
+CLOCK_SKEW = 300
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+
+class InvalidIdToken(ValueError):
+    pass
+
+
+class KeySource(object):
+    """
+    Where a cached document comes from.  fetch() returns the parsed document
+    and how long (seconds) it may be cached for, or None for the default.
+    """
+
+    def fetch(self):
+        raise NotImplementedError
+
+
+class StaticKeySource(KeySource):
+    """
+    Serves a fixed document, e.g. a JWKS built from locally generated keys.
+    """
+
+    def __init__(self, document, ttl=None):
+        self.document = document
+        self.ttl = ttl
+
+    def fetch(self):
+        return self.document, self.ttl
+
+
+class HttpKeySource(KeySource):
+    """
+    Fetches a JSON document over the provider's pooled HTTP session.  url may
+    be a callable so that it's looked up (e.g. from discovery) on each fetch.
+    """
+
+    def __init__(self, provider, url):
+        self.provider = provider
+        self.url = url
+
+    def fetch(self):
+        url = self.url() if callable(self.url) else self.url
+        r = providers.get(self.provider, url)
+        r.raise_for_status()
+        match = re.search(r'max-age=(\d+)', r.headers.get('Cache-Control', ''))
+        return r.json(), int(match.group(1)) if match else None
+
+
+class CachedDocument(object):
+    """
+    A document from a KeySource, cached with a TTL.  Once it's most of the
+    way to expiring, a background thread fetches a fresh copy while callers
+    carry on using the old one.  If a fetch fails, the stale copy is kept.
+    Safe to share between threads.
+    """
+
+    def __init__(self, source, ttl=DEFAULT_TTL):
+        self.source = source
+        self.ttl = ttl
+        self.document = None
+        self.fetched = 0
+        self.expires = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def set_source(self, source):
+        """
+        Switches to a different source, dropping anything cached.
+        """
+        with self._lock:
+            self.source = source
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.document = None
+            self.fetched = self.expires = 0
+
+    def get(self):
+        now = time.time()
+        if self.document is None or now >= self.expires:
+            self.misses += 1
+            return self.refresh(force=False)
+
+        self.hits += 1
+        if now >= self.fetched + (self.expires - self.fetched) * REFRESH_AHEAD:
+            self._refresh_in_background()
+        return self.document
+
+    def refresh(self, force=True):
+        """
+        Fetches the document now.  Returns the fresh copy, or the stale one if
+        the fetch fails and there is one.  Without force, a copy that another
+        thread fetched while we waited for the lock is good enough.
+        """
+        with self._lock:
+            if not force and self.document is not None \
+                    and time.time() < self.expires:
+                return self.document
+            try:
+                document, ttl = self.source.fetch()
+            except Exception:
+                self.errors += 1
+                if self.document is None:
+                    raise
+                return self.document
+            self.refreshes += 1
+            self.document = document
+            self.fetched = time.time()
+            self.expires = self.fetched + (ttl if ttl is not None else self.ttl)
+            return document
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'refreshes': self.refreshes, 'errors': self.errors}
+
+
+class KeySet(CachedDocument):
+    """
+    A cached JWKS, looked up by key id.
+    """
+
+    def get_key(self, kid):
+        key = self._find(self.get(), kid)
+        if key is None and time.time() - self.fetched >= MIN_REFETCH_INTERVAL:
+            # Probably a key we haven't seen yet.
+            self.misses += 1
+            key = self._find(self.refresh(), kid)
+        if key is None:
+            raise InvalidIdToken('Unknown signing key %r' % kid)
+        return key
+
+    @staticmethod
+    def _find(jwks, kid):
+        keys = jwks.get('keys') if isinstance(jwks, dict) else None
+        for key in keys if isinstance(keys, list) else []:
+            if isinstance(key, dict) and key.get('kid') == kid:
+                return key
+        return None
+
+
+def b64decode(segment):
+    if isinstance(segment, str):
+        segment = segment.encode('ascii')
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def b64int(segment):
+    return int.from_bytes(b64decode(segment), 'big')
+
+
+def verify_id_token(id_token, audience, keys, issuers=GOOGLE_ISSUERS):
+    """
+    Checks an OpenID Connect ID token's RS256 signature against the cached
+    keys, along with its expiry, audience and issuer.  Returns the claims, or
+    raises InvalidIdToken.
+    """
+    try:
+        header_segment, claims_segment, signature = id_token.split('.')
+        header = json.loads(b64decode(header_segment).decode('utf-8'))
+        claims = json.loads(b64decode(claims_segment).decode('utf-8'))
+        signature = b64decode(signature)
+    except (AttributeError, ValueError, TypeError):
+        raise InvalidIdToken('Malformed token')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise InvalidIdToken('Malformed token')
+
+    if header.get('alg') != 'RS256':
+        raise InvalidIdToken('Unsupported algorithm %r' % header.get('alg'))
+
+    jwk = keys.get_key(header.get('kid'))
+    try:
+        public_key = rsa.PublicKey(b64int(jwk['n']), b64int(jwk['e']))
+    except (KeyError, TypeError, ValueError):
+        raise InvalidIdToken('Malformed signing key %r' % header.get('kid'))
+    try:
+        rsa.verify((header_segment + '.' + claims_segment).encode('ascii'),
+                   signature, public_key)
+    except rsa.VerificationError:
+        raise InvalidIdToken('Bad signature')
+
+    try:
+        expires, issued = int(claims.get('exp', 0)), int(claims.get('iat', 0))
+    except (TypeError, ValueError):
+        raise InvalidIdToken('Malformed token times')
+    now = time.time()
+    if expires < now - CLOCK_SKEW:
+        raise InvalidIdToken('Token expired')
+    if issued > now + CLOCK_SKEW:
+        raise InvalidIdToken('Token issued in the future')
+    if claims.get('aud') != audience:
+        raise InvalidIdToken('Wrong audience')
+    if claims.get('iss') not in issuers:
+        raise InvalidIdToken('Wrong issuer')
+    if not isinstance(claims.get('sub'), str):
+        raise InvalidIdToken('No subject')
+    return claims
+
+
+# Google's OpenID Connect discovery document and signing keys, shared by all
+# requests in the process.
+google_discovery = CachedDocument(HttpKeySource(
+    'google', lambda: providers.provider_url(
+        'google_accounts', '/.well-known/openid-configuration')))
+
+google_keys = KeySet(HttpKeySource(
+    'google', lambda: google_discovery_url('jwks_uri')))
+
+
+def google_discovery_url(name):
+    """
+    Returns a URL from Google's discovery document.  Raises ValueError if
+    the document doesn't have it, as for a response that isn't JSON.
+    """
+    document = google_discovery.get()
+    url = document.get(name) if isinstance(document, dict) else None
+    if not isinstance(url, str):
+        raise ValueError('No %s in the discovery document' % name)
+    return url
+
+
+def google_token_endpoint():
+    return google_discovery_url('token_endpoint')
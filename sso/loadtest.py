@@ -0,0 +1,325 @@
+"""
+Pieces for the loadtest management command: a local threaded HTTP server for
+the site, an SMTP sink that catches outgoing mail, and the user flows.
+
+    sink = SmtpSink()
+    sink.start()
+    server = LocalServer(QueryCounter(get_wsgi_application()))
+    server.start()
+    ... LoadTest(server.url, sink, recorder).run(users=10, iterations=5)
+
+The provider callbacks are served by sso.stubprovider.StubProvider.
+"""
+import re
+import threading
+import time
+import uuid
+from email import message_from_string
+from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+import requests
+from django.db import connection
+from .bench import percentile
+
+
+class SmtpHandler(StreamRequestHandler):
+    """
+    Just enough SMTP for smtplib (and so Django's SMTP backend) to deliver
+    to an SmtpSink: no extensions, authentication or TLS.
+    """
+
+    def handle(self):
+        self.reply('220 localhost SMTP sink')
+        mailfrom, rcpttos = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode('utf-8').strip().partition(' ')
+            command = command.upper()
+            if command in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                mailfrom, rcpttos = self.address(arg), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                rcpttos.append(self.address(arg))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.server.sink.process_message(
+                    self.client_address, mailfrom, rcpttos, self.read_data())
+                mailfrom, rcpttos = None, []
+                self.reply('250 OK')
+            elif command == 'RSET':
+                mailfrom, rcpttos = None, []
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            # Undo the dot-stuffing.
+            if line.startswith(b'.'):
+                line = line[1:]
+            lines.append(line.decode('utf-8').rstrip('\r\n'))
+        return '\n'.join(lines)
+
+    def address(self, arg):
+        # "FROM:<sam@example.com>" or "TO:<sam@example.com>"
+        return arg.partition(':')[2].strip().lstrip('<').partition('>')[0]
+
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+
+class SmtpServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class SmtpSink(object):
+    """
+    An SMTP server that keeps every message it's sent, by recipient.
+    """
+
+    def __init__(self):
+        self.server = SmtpServer(('127.0.0.1', 0), SmtpHandler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self.messages = {}
+        self.received = 0
+        self._condition = threading.Condition()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        message = message_from_string(data)
+        with self._condition:
+            self.received += 1
+            for recipient in rcpttos:
+                self.messages[recipient] = message
+            self._condition.notify_all()
+
+    def wait_for(self, recipient, timeout=30):
+        """
+        Returns (and forgets) the last message sent to recipient, waiting
+        for it to arrive if need be.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: recipient in self.messages, timeout):
+                raise TimeoutError('No mail for %s after %ss' % (recipient, timeout))
+            return self.messages.pop(recipient)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class LocalServer(object):
+    """
+    Serves a WSGI application on a free local port, a thread per request.
+    """
+
+    def __init__(self, app):
+        self.httpd = ThreadingWSGIServer(('127.0.0.1', 0), QuietHandler)
+        self.httpd.set_app(app)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+
+class QueryCounter(object):
+    """
+    WSGI middleware counting the SQL queries each request makes, by
+    'METHOD /path'.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        # The database connection is per thread, so this only sees this
+        # request's queries.  Connecting first keeps the per-connection
+        # setup (e.g. SQLite pragmas) out of the count.
+        connection.ensure_connection()
+        connection.force_debug_cursor = True
+        connection.queries_log.clear()
+        response = self.app(environ, start_response)
+        count = len(connection.queries_log)
+        key = '%s %s' % (environ['REQUEST_METHOD'], environ['PATH_INFO'])
+        with self._lock:
+            self.counts.setdefault(key, []).append(count)
+        return response
+
+
+class Recorder(object):
+    """
+    Collects request timings per step.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds, ok=True):
+        with self._lock:
+            self.samples.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+    def report(self, elapsed, queries):
+        """
+        Yields one line per step: requests/s, latency percentiles, queries
+        per request and errors.
+        """
+        yield '%-24s %7s %8s %8s %8s %8s %9s %6s' % (
+            'step', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors')
+        for step, samples in self.samples.items():
+            counts = queries.get(step, [])
+            yield '%-24s %7d %8.1f %8.1f %8.1f %8.1f %9s %6d' % (
+                step, len(samples), len(samples) / elapsed,
+                percentile(samples, 50) * 1000, percentile(samples, 95) * 1000,
+                percentile(samples, 99) * 1000,
+                '%.1f' % (sum(counts) / len(counts)) if counts else '-',
+                self.errors.get(step, 0))
+
+
+class FlowFailed(Exception):
+    pass
+
+
+class LoadTest(object):
+    """
+    Drives signup -> verify -> signin -> welcome, plus the provider
+    callbacks, from a number of concurrent simulated users.
+    """
+    PASSWORD = 'load-test-password'
+    TOKEN_LINK = re.compile(r'/verify\?token=(\S+)')
+    OAUTH_STATE = re.compile(r'state=(\w+)')
+
+    def __init__(self, base_url, sink, recorder, callbacks=True):
+        self.base_url = base_url
+        self.sink = sink
+        self.recorder = recorder
+        self.callbacks = callbacks
+        self.flows = self.failed_flows = 0
+        self._lock = threading.Lock()
+
+    def request(self, session, method, path, expect=200, **kwargs):
+        step = '%s %s' % (method, path)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path,
+                                       allow_redirects=False, timeout=60, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(step, time.perf_counter() - start, False)
+            raise FlowFailed('%s: %s' % (step, e))
+        ok = response.status_code == expect
+        self.recorder.record(step, time.perf_counter() - start, ok)
+        if not ok:
+            raise FlowFailed('%s: HTTP %d' % (step, response.status_code))
+        return response
+
+    def post(self, session, path, data, expect=200):
+        # The CSRF cookie is rotated at login, so read it fresh every time.
+        data = dict(data, csrfmiddlewaretoken=session.cookies.get('csrftoken', ''))
+        return self.request(session, 'POST', path, data=data, expect=expect,
+                            headers={'Referer': self.base_url + path})
+
+    def signup_flow(self, session):
+        email = 'load-%s@example.com' % uuid.uuid4().hex
+        self.request(session, 'GET', '/signin')
+        self.post(session, '/signup', {'email': email})
+
+        start = time.perf_counter()
+        try:
+            message = self.sink.wait_for(email)
+        except TimeoutError as e:
+            self.recorder.record('mail delivery', time.perf_counter() - start, False)
+            raise FlowFailed(str(e))
+        self.recorder.record('mail delivery', time.perf_counter() - start)
+        token = self.TOKEN_LINK.search(message.get_payload()).group(1)
+
+        self.request(session, 'GET', '/verify', params={'token': token})
+        self.post(session, '/verify', {'token': token, 'password': self.PASSWORD,
+                                       'short_name': 'Load'}, expect=302)
+        self.request(session, 'GET', '/signout', expect=302)
+        self.post(session, '/signin', {'email': email, 'password': self.PASSWORD},
+                  expect=302)
+        self.request(session, 'GET', '/welcome')
+
+    def callback_flow(self, session):
+        # The stub provider treats each new code as a new account, which the
+        # first callback links to the signed-in member and the second signs
+        # straight back in.  The state comes from the sign-in page's links.
+        page = self.request(session, 'GET', '/signin')
+        state = self.OAUTH_STATE.search(page.text).group(1)
+        for provider in ('github', 'google', 'facebook'):
+            code = uuid.uuid4().hex
+            for _ in range(2):
+                self.request(session, 'GET', '/callback/' + provider,
+                             params={'code': code, 'state': state}, expect=302)
+
+    def user(self, iterations):
+        for _ in range(iterations):
+            session = requests.Session()
+            try:
+                self.signup_flow(session)
+                if self.callbacks:
+                    self.callback_flow(session)
+                ok = True
+            except FlowFailed:
+                ok = False
+            finally:
+                session.close()
+            with self._lock:
+                self.flows += 1
+                self.failed_flows += not ok
+
+    def run(self, users, iterations):
+        """
+        Runs the flows and returns the elapsed time in seconds.
+        """
+        threads = [threading.Thread(target=self.user, args=(iterations,))
+                   for _ in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
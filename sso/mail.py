@@ -1,15 +1,28 @@
-from django.core.mail import send_mail
+import time
+from django.core.mail import EmailMessage, get_connection
 from django.template.loader import render_to_string
+from . import metrics
+from .models import OutboundMail
 
 # TODO: move this into settings
 MAIL_FROM = "noreply@example.com"
 
+# How many queued messages the worker sends over one SMTP connection.
+MAIL_BATCH_SIZE = 100
+
+
+# Put a message on the outbound queue.  The send_queued_mail management
+# command takes care of actually delivering it, so callers never wait on
+# the mail server.
+def queue_mail(subject, message, from_email, recipient_list):
+    OutboundMail.enqueue(subject, message, from_email, recipient_list)
+
 
 VERIFY_EMAIL_SUBJECT = "Welcome to FM Proejct!"
 
 # Send a request to verify email.  Used for signing up new members.
 def send_verify_link(request, email, token):
-    send_mail(
+    queue_mail(
         VERIFY_EMAIL_SUBJECT,
         render_to_string('sso/emailverify', {'link': request.build_absolute_uri('/verify?token=' + token)}),
         MAIL_FROM,
@@ -22,3 +35,45 @@ RESET_PASSWORD_SUBJECT = "Reset your FM Project password"
 # Send an email with a link to reset password
 def send_reset_password_link(request, email):
     pass
+
+
+def send_queued_mail(batch_size=MAIL_BATCH_SIZE, connection=None):
+    """
+    Sends one batch of due messages from the outbound queue, reusing a single
+    connection to the mail server for the whole batch.  Each message is
+    claimed before it's sent, so concurrent workers never send it twice.
+    Messages that fail are rescheduled with backoff.  Returns a (sent, failed) tuple.
+    """
+    batch = OutboundMail.due(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        for mail in batch:
+            # Another worker, or an inline flush, may have the same batch.
+            if not mail.claim():
+                continue
+            message = EmailMessage(mail.subject, mail.body, mail.from_email,
+                                   (mail.to,), connection=connection)
+            start = time.perf_counter()
+            try:
+                # open() is a no-op while the connection is still up.
+                connection.open()
+                message.send()
+            except Exception as e:
+                metrics.mail_send_seconds.observe(time.perf_counter() - start, 'failed')
+                mail.failed(e)
+                failed += 1
+                # The connection may be unusable after an error, so drop it
+                # and let the next message reconnect.
+                connection.close()
+            else:
+                metrics.mail_send_seconds.observe(time.perf_counter() - start, 'sent')
+                mail.sent()
+                sent += 1
+    finally:
+        connection.close()
+
+    return sent, failed
@@ -0,0 +1,63 @@
+import glob
+import os
+from collections import Counter
+from django.core.management.base import BaseCommand
+from sso.profiling import profiler_options, read_folded
+
+
+class Command(BaseCommand):
+    help = ('Merges the folded stacks written by the profiler middleware '
+            '(SSO_PROFILER) into one file for flamegraph.pl or speedscope, '
+            'each stack rooted at its view name, or lists the hottest '
+            'functions with --top.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Where the profiles are.  Defaults '
+                                          "to SSO_PROFILER['DIR'].")
+        parser.add_argument('--view', action='append', dest='views',
+                            help='Only this view (may be repeated).')
+        parser.add_argument('--output', help='File to write (default: stdout).')
+        parser.add_argument('--top', type=int,
+                            help='Instead, list the N functions with the most '
+                                 'samples, self and total.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or profiler_options()['DIR']
+        stacks = Counter()
+        for path in sorted(glob.glob(os.path.join(directory, '*.folded'))):
+            view = os.path.basename(path).rsplit('.', 2)[0]
+            if options['views'] and view not in options['views']:
+                continue
+            for stack, count in read_folded(path):
+                stacks[view + ';' + stack] += count
+
+        if not stacks:
+            self.stderr.write('No profiles in %s' % directory)
+            return
+        if options['top']:
+            self.top(stacks, options['top'])
+            return
+
+        lines = ('%s %d' % item for item in sorted(stacks.items()))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.writelines(line + '\n' for line in lines)
+        else:
+            for line in lines:
+                self.stdout.write(line)
+
+    def top(self, stacks, n):
+        total = sum(stacks.values())
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            # A recursive function counts once per stack.
+            for frame in set(frames):
+                total_counts[frame] += count
+        self.stdout.write('%7s %7s  %s' % ('self %', 'total %', 'function'))
+        for frame, count in self_counts.most_common(n):
+            self.stdout.write('%7.1f %7.1f  %s' % (
+                100.0 * count / total, 100.0 * total_counts[frame] / total, frame))
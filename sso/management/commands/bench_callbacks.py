@@ -0,0 +1,131 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from sso.asgi import AsgiHandler
+from sso.bench import scratch_database
+from sso.views import OAUTH_STATE_KEY
+from sso.stubprovider import StubProvider
+
+
+class Command(BaseCommand):
+    help = ('Load-tests the OAuth callbacks against a local stub provider, '
+            'comparing sync WSGI workers with the asyncio ASGI handler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', default='github',
+                            choices=('github', 'google', 'facebook'))
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Callback requests to make per mode.')
+        parser.add_argument('--concurrency', type=int, default=500,
+                            help='Callbacks in flight at once for ASGI.')
+        parser.add_argument('--workers', type=int, default=20,
+                            help='Sync WSGI worker threads to compare with.')
+        parser.add_argument('--delay', type=float, default=0.1,
+                            help='Seconds the stub provider takes per call.')
+
+    def handle(self, *args, **options):
+        # Every callback signs in the same member, who's created by the first
+        # one.  The callbacks run on worker threads, each with its own
+        # connection, so rather than scratch_transaction() the members,
+        # identities and sessions go in a scratch database.
+        stub = StubProvider(delay=options['delay'])
+        stub.start()
+        self.path = '/callback/' + options['provider']
+        try:
+            with override_settings(SSO_PROVIDER_URLS=stub.provider_urls(),
+                                   ALLOWED_HOSTS=['*']), \
+                    scratch_database(options['verbosity']):
+                wsgi = get_wsgi_application()
+                self.report('WSGI, %d threads' % options['workers'],
+                            options['requests'],
+                            self.run_wsgi(wsgi, options['requests'],
+                                          options['workers']))
+                self.report('ASGI, %d in flight' % options['concurrency'],
+                            options['requests'],
+                            self.run_asgi(AsgiHandler(wsgi), options['requests'],
+                                          options['concurrency']))
+        finally:
+            stub.stop()
+
+    def report(self, label, count, result):
+        elapsed, failures = result
+        self.stdout.write('%-22s %8.1f callbacks/s  (%d failed)'
+                          % (label, count / elapsed, failures))
+
+    def session_cookies(self, count):
+        """
+        Makes a session per callback holding the OAuth state, as the sign-in
+        page would.  (Signing in replaces the session, so they can't share.)
+        """
+        engine = import_module(settings.SESSION_ENGINE)
+        cookies = []
+        for _ in range(count):
+            session = engine.SessionStore()
+            session[OAUTH_STATE_KEY] = 'bench'
+            session.save()
+            cookies.append('%s=%s' % (settings.SESSION_COOKIE_NAME,
+                                      session.session_key))
+        return cookies
+
+    def environ(self, cookie):
+        return {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': self.path,
+            'QUERY_STRING': 'code=bench&state=bench', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+            'HTTP_COOKIE': cookie,
+        }
+
+    def run_wsgi(self, wsgi, count, workers):
+        def call(cookie):
+            status = []
+            body = wsgi(self.environ(cookie), lambda s, h, e=None: status.append(s))
+            b''.join(body)
+            return status[0].startswith('302')
+
+        cookies = self.session_cookies(count)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(call, cookies))
+        return time.perf_counter() - start, results.count(False)
+
+    def run_asgi(self, app, count, concurrency):
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def call(semaphore, cookie):
+            messages = []
+            scope = {'type': 'http', 'method': 'GET', 'path': self.path,
+                     'query_string': b'code=bench&state=bench',
+                     'headers': [(b'cookie', cookie.encode('ascii'))]}
+
+            async def send(message):
+                messages.append(message)
+
+            async with semaphore:
+                await app(scope, receive, send)
+            return messages[0]['status'] == 302
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            results = await asyncio.gather(*[call(semaphore, cookie)
+                                             for cookie in cookies])
+            await app.providers.close()
+            return results
+
+        cookies = self.session_cookies(count)
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            results = loop.run_until_complete(run())
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.close()
+        return elapsed, results.count(False)
@@ -0,0 +1,81 @@
+import random
+import time
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from sso.bench import scratch_transaction, timed, summarize
+from sso.models import Member
+
+
+class Command(BaseCommand):
+    help = ('Seeds a large Member table and times case-insensitive sign-in '
+            'lookups, admin email search and admin paging, through email_key '
+            'and the way they were done before it.  Runs in a rolled-back '
+            'transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of Member rows to seed.')
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Lookups to time for each query.')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+
+        with scratch_transaction():
+            self.stdout.write('Seeding %d rows...' % rows)
+            start = time.perf_counter()
+            self.seed(rows)
+            self.stdout.write('  done in %.1fs' % (time.perf_counter() - start))
+
+            def sample_emails():
+                return iter('Bench%d@Example.com' % i
+                            for i in random.choices(range(rows), k=repeat))
+
+            self.stdout.write('sign-in lookup')
+            emails = sample_emails()
+            samples = timed(lambda: Member.objects.get_by_natural_key(next(emails)),
+                            repeat)
+            self.stdout.write('  email_key           ' + summarize(samples))
+            emails = sample_emails()
+            samples = timed(lambda: Member.objects.get(email__iexact=next(emails)),
+                            repeat)
+            self.stdout.write('  email__iexact       ' + summarize(samples))
+
+            # One changelist page of results for a prefix such as 'Bench1234'.
+            self.stdout.write('admin search (first page)')
+            member_admin = admin.site._registry[Member]
+            prefixes = iter(email.split('@')[0][:-1] for email in sample_emails())
+            samples = timed(lambda: list(member_admin.get_search_results(
+                None, Member.objects.all(), next(prefixes))[0][:100]), repeat)
+            self.stdout.write('  email_key prefix    ' + summarize(samples))
+            prefixes = iter(email.split('@')[0][:-1] for email in sample_emails())
+            samples = timed(lambda: list(Member.objects.filter(
+                email__icontains=next(prefixes))[:100]), repeat)
+            self.stdout.write('  email__icontains    ' + summarize(samples))
+
+            # A changelist page deep into the table: the stock admin's
+            # COUNT(*) plus OFFSET, against KeysetChangeList's range scan.
+            self.stdout.write('admin changelist, page %d (100 per page)' % (rows // 200))
+            ordered = Member.objects.order_by('email_key')
+            after = ordered.values_list('email_key', flat=True)[rows // 2]
+            samples = timed(lambda: list(ordered.filter(email_key__gt=after)[:100]),
+                            repeat)
+            self.stdout.write('  keyset              ' + summarize(samples))
+            samples = timed(lambda: (ordered.count(),
+                                     list(ordered[rows // 2:rows // 2 + 100])),
+                            max(repeat // 10, 1))
+            self.stdout.write('  count + offset      ' + summarize(samples))
+
+    def seed(self, rows):
+        # Hashing a million passwords would take hours; they all share one.
+        password = make_password('bench')
+        batch = []
+        for i in range(rows):
+            email = 'bench%d@example.com' % i
+            batch.append(Member(email=email, email_key=email, short_name='Bench',
+                                password=password))
+            if len(batch) == 5000:
+                Member.objects.bulk_create(batch)
+                batch = []
+        Member.objects.bulk_create(batch)
@@ -0,0 +1,56 @@
+import multiprocessing
+import time
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+
+
+def hash_for(seconds, algorithm):
+    """
+    Hashes passwords for the given number of seconds and returns the count.
+    """
+    hasher = get_hasher(algorithm)
+    salt = hasher.salt()
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        hasher.encode('correct horse battery staple', salt)
+        count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = ('Reports password hashes/second per core for the configured '
+            'hashers, for sizing hosts against a target sign-in rate.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', action='append',
+                            help='Hasher algorithm to measure (default: the '
+                                 'preferred hasher).  May be repeated.')
+        parser.add_argument('--seconds', type=float, default=3.0,
+                            help='How long to hash for, per algorithm.')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Hash in this many processes at once, to see '
+                                 'how throughput scales across cores.')
+
+    def handle(self, *args, **options):
+        algorithms = options['algorithm'] or ['default']
+        seconds, processes = options['seconds'], options['processes']
+
+        for algorithm in algorithms:
+            try:
+                hasher = get_hasher(algorithm)
+                hasher.encode('warm-up', hasher.salt())
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            if processes == 1:
+                counts = [hash_for(seconds, algorithm)]
+            else:
+                with multiprocessing.Pool(processes) as pool:
+                    counts = pool.starmap(hash_for, [(seconds, algorithm)] * processes)
+
+            total = sum(counts) / seconds
+            self.stdout.write('%-14s %9.1f hashes/s per core  %9.1f hashes/s over %d '
+                              'process(es)  %7.2f ms/hash'
+                              % (hasher.algorithm, total / processes, total,
+                                 processes, 1000.0 * processes / total))
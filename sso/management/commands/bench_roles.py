@@ -0,0 +1,66 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from sso.bench import scratch_transaction, timed, summarize
+from sso.models import Member
+
+
+# Role bits and the share of members holding each, roughly how roles tend to
+# be spread: most members have none, a few are common, one is rare.
+ROLE_SHARES = [(1, 0.20), (2, 0.05), (4, 0.01), (8, 0.0005)]
+
+
+class Command(BaseCommand):
+    help = ('Seeds a large Member table and times role queries through '
+            'with_any_role()/with_all_roles() against a bitwise SQL filter '
+            'and filtering in Python.  Runs in a rolled-back transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of Member rows to seed.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Times to run each query.')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+
+        with scratch_transaction():
+            self.stdout.write('Seeding %d rows...' % rows)
+            start = time.perf_counter()
+            self.seed(rows)
+            self.stdout.write('  done in %.1fs' % (time.perf_counter() - start))
+
+            queries = [
+                ('any of 8 (rare)', Member.objects.with_any_role(8),
+                 'roles & 8 != 0', lambda roles: roles & 8),
+                ('any of 4|8', Member.objects.with_any_role(12),
+                 'roles & 12 != 0', lambda roles: roles & 12),
+                ('all of 1|2', Member.objects.with_all_roles(3),
+                 'roles & 3 = 3', lambda roles: roles & 3 == 3),
+            ]
+            for label, indexed, where, match in queries:
+                bitwise = Member.objects.extra(where=[where])
+                self.stdout.write('%s: %d members' % (label, indexed.count()))
+                samples = timed(lambda: list(indexed.values_list('id', flat=True)), repeat)
+                self.stdout.write('  roles IN (...)  ' + summarize(samples))
+                samples = timed(lambda: list(bitwise.values_list('id', flat=True)), repeat)
+                self.stdout.write('  roles & mask    ' + summarize(samples))
+                samples = timed(lambda: [id for id, roles in
+                                         Member.objects.values_list('id', 'roles')
+                                         if match(roles)], max(repeat // 5, 1))
+                self.stdout.write('  in Python       ' + summarize(samples))
+
+    def seed(self, rows):
+        batch = []
+        for i in range(rows):
+            roles = 0
+            for bit, share in ROLE_SHARES:
+                if random.random() < share:
+                    roles |= bit
+            email = 'bench%d@example.com' % i
+            batch.append(Member(email=email, email_key=email, short_name='Bench',
+                                password='!', roles=roles))
+            if len(batch) == 5000:
+                Member.objects.bulk_create(batch)
+                batch = []
+        Member.objects.bulk_create(batch)
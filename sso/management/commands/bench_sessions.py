@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from sso.bench import scratch_transaction
+from sso.models import Member
+
+
+ENGINES = (
+    ('db', 'django.contrib.sessions.backends.db'),
+    ('signed', 'sso.sessions'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Measures requests/second for the welcome page with database '
+            'and signed-cookie sessions.  Runs in a rolled-back transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests to make per session engine.')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        with scratch_transaction():
+            Member.objects.create_user('bench@example.com', 'Bench', 'bench')
+            for label, engine in ENGINES:
+                with override_settings(SESSION_ENGINE=engine,
+                                       ALLOWED_HOSTS=['testserver']):
+                    client = Client()
+                    client.login(email='bench@example.com', password='bench')
+                    client.get('/welcome')
+
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        for _ in range(count):
+                            response = client.get('/welcome')
+                        elapsed = time.perf_counter() - start
+                    assert response.status_code == 200
+
+                    self.stdout.write('%-8s %8.1f requests/s  %.1f queries/request'
+                                      % (label, count / elapsed,
+                                         len(queries) / float(count)))
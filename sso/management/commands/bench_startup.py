@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sso.bench import timed, summarize
+from sso.conf import ProviderConfig
+
+
+# Run in a fresh interpreter: time from start to a fully set up sso app.
+STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+import django
+django.setup()
+import sso.views
+print(time.perf_counter() - start)
+'''
+
+# The same, done the way it was before provider config was loaded lazily:
+# config.json parsed as sso.apps is imported, and the provider SDKs imported
+# with sso.views.  (config.json.example stands in if there's no config.json,
+# which back then was a crash.)
+BASELINE_SCRIPT = '''
+import time
+start = time.perf_counter()
+import json
+import os
+import django
+from django.conf import settings
+path = os.path.join(settings.BASE_DIR, 'fmproject', 'config.json')
+if not os.path.exists(path):
+    path += '.example'
+with open(path) as f:
+    json.load(f)
+django.setup()
+import facebook
+import httplib2
+from oauth2client import client
+import sso.views
+print(time.perf_counter() - start)
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measures how long a fresh process takes to set up Django and sso.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20,
+                            help='Fresh processes to start.')
+        parser.add_argument('--baseline', action='store_true',
+                            help='Also time the old eager startup, for '
+                                 'comparison.')
+
+    def handle(self, *args, **options):
+        if options['baseline']:
+            self.stdout.write('eager (before)            ' +
+                              summarize(self.startup(BASELINE_SCRIPT, options['runs'])))
+        self.stdout.write('setup + import sso.views  ' +
+                          summarize(self.startup(STARTUP_SCRIPT, options['runs'])))
+
+        config = ProviderConfig()
+        samples = timed(config.load, 1000)
+        self.stdout.write('provider config load      ' + summarize(samples))
+        samples = timed(lambda: config.get('github', 'client_id'), 1000)
+        self.stdout.write('cached provider lookup    ' + summarize(samples))
+
+    def startup(self, script, runs):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        samples = []
+        for _ in range(runs):
+            out = subprocess.check_output([sys.executable, '-c', script],
+                                          cwd=settings.BASE_DIR, env=env)
+            samples.append(float(out.decode('ascii').split()[-1]))
+        return samples
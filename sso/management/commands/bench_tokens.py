@@ -0,0 +1,37 @@
+import random
+import string
+import time
+from django.core.management.base import BaseCommand
+from sso.models import (create_token, random_token_chars, TokenPool,
+                        EMAIL_TOKEN_LENGTH)
+
+
+# The original implementation, kept here for comparison.
+def create_token_random_choice():
+    return ''.join(random.choice(string.ascii_letters + string.digits)
+                   for _ in range(EMAIL_TOKEN_LENGTH))
+
+
+class Command(BaseCommand):
+    help = 'Compares email verify token generators in tokens per second.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000,
+                            help='Tokens to generate with each method.')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        big_pool = TokenPool(4096)
+        generators = (
+            ('random.choice (old)', create_token_random_choice),
+            ('urandom, one token per call',
+             lambda: random_token_chars(EMAIL_TOKEN_LENGTH)),
+            ('create_token (pooled)', create_token),
+            ('pool of 4096', big_pool.get),
+        )
+        for label, generate in generators:
+            start = time.perf_counter()
+            for _ in range(count):
+                generate()
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%-30s %10.0f tokens/s' % (label, count / elapsed))
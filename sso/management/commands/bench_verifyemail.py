@@ -0,0 +1,85 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from sso.bench import scratch_transaction, timed, summarize
+from sso.models import VerifyEmail
+
+
+class Command(BaseCommand):
+    help = ('Seeds a large VerifyEmail table and times redeem_token(), '
+            'remove() and cron() with and without the indexes.  Everything '
+            'runs in a transaction that is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of VerifyEmail rows to seed.')
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Lookups to time for redeem and remove.')
+        parser.add_argument('--expired-percent', type=int, default=5,
+                            help='Percentage of seeded tokens that have '
+                                 'already expired (for cron to delete).')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        self.expired_percent = options['expired_percent']
+
+        with scratch_transaction():
+            self.stdout.write('Seeding %d rows...' % rows)
+            start = time.perf_counter()
+            self.seed(rows)
+            self.stdout.write('  done in %.1fs' % (time.perf_counter() - start))
+
+            self.report('with indexes (after)', rows, repeat)
+            self.drop_indexes()
+            self.report('without indexes (before)', rows, repeat)
+
+    def is_expired(self, i):
+        return i % 100 < self.expired_percent
+
+    def seed(self, rows):
+        now = int(time.time())
+        batch = []
+        for i in range(rows):
+            expires = now - 86400 if self.is_expired(i) else now + 86400
+            email = 'bench%d@example.com' % i
+            batch.append(VerifyEmail(email=email, email_key=email,
+                                     token='%064d' % i, expires=expires))
+            if len(batch) == 5000:
+                VerifyEmail.objects.bulk_create(batch)
+                batch = []
+        VerifyEmail.objects.bulk_create(batch)
+
+    def report(self, label, rows, repeat):
+        self.stdout.write(label)
+
+        live = [i for i in random.sample(range(rows), repeat * 2)
+                if not self.is_expired(i)][:repeat]
+        tokens = iter('%064d' % i for i in live)
+        samples = timed(lambda: VerifyEmail.redeem_token(next(tokens)), len(live))
+        self.stdout.write('  redeem_token  ' + summarize(samples))
+
+        emails = iter('bench%d@example.com' % i
+                      for i in random.sample(range(rows), repeat))
+        with scratch_transaction():
+            samples = timed(lambda: VerifyEmail.remove(next(emails)), repeat)
+        self.stdout.write('  remove        ' + summarize(samples))
+
+        with scratch_transaction():
+            samples = timed(VerifyEmail.cron)
+        self.stdout.write('  cron          ' + summarize(samples))
+
+    def drop_indexes(self):
+        # Drop every plain (non-unique) index, leaving the table as it was
+        # in the initial migration.
+        table = VerifyEmail._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        with connection.schema_editor() as editor:
+            for name, info in constraints.items():
+                if info['index'] and not info['unique'] and not info['primary_key']:
+                    editor.execute(editor.sql_delete_index % {
+                        'name': editor.quote_name(name),
+                        'table': editor.quote_name(table),
+                    })
@@ -0,0 +1,50 @@
+import io
+import sys
+import time
+from django.core.management.base import BaseCommand
+from sso.memberio import FIELDS, FORMATS, RowWriter, guess_format, member_to_row
+from sso.models import Member
+
+
+class Command(BaseCommand):
+    help = ('Exports members, with their password hashes, as CSV or JSON '
+            'Lines.  The output can be read back by import_members.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, or '-' for stdout.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='File format (default: from the file name, '
+                                 'or csv for stdout).')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows to fetch per query.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        start = time.perf_counter()
+
+        if path == '-':
+            count = self.export(sys.stdout, format, options['batch_size'])
+        else:
+            with io.open(path, 'w', encoding='utf-8', newline='') as file:
+                count = self.export(file, format, options['batch_size'])
+
+        elapsed = time.perf_counter() - start
+        self.stderr.write('Exported %d members in %.1fs (%.0f rows/s)'
+                          % (count, elapsed, count / (elapsed or 1)))
+
+    def export(self, file, format, batch_size):
+        # Pages by primary key (WHERE id > last ORDER BY id LIMIT n) rather
+        # than OFFSET, so each query is an index range scan and memory stays
+        # at one batch whatever the database driver does with cursors.
+        writer = RowWriter(file, format)
+        count = last_id = 0
+        while True:
+            batch = list(Member.objects.filter(id__gt=last_id).order_by('id')
+                         .values('id', *FIELDS)[:batch_size])
+            for values in batch:
+                writer.write(member_to_row(values))
+            count += len(batch)
+            if len(batch) < batch_size:
+                return count
+            last_id = batch[-1]['id']
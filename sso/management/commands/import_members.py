@@ -0,0 +1,110 @@
+import io
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from sso.memberio import FORMATS, BadRow, guess_format, member_from_row, read_rows
+from sso.models import Member
+
+
+class Command(BaseCommand):
+    help = ('Imports members from a CSV or JSON Lines file in batches, '
+            'keeping memory use flat.  Passwords are taken as already-hashed '
+            '(see sso/memberio.py).  Members whose email is already '
+            'registered are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='File format (default: from the file name).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows to insert per transaction.')
+        parser.add_argument('--checkpoint',
+                            help='File that records progress after each batch '
+                                 '(default: PATH.checkpoint).')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the rows the checkpoint says are done.')
+        parser.add_argument('--hash-plaintext', action='store_true',
+                            help='Hash passwords that are not recognized '
+                                 'hashes, instead of rejecting the row.  Slow.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        self.checkpoint = options['checkpoint'] or path + '.checkpoint'
+        batch_size = options['batch_size']
+
+        self.verbosity = options['verbosity']
+        if not os.path.exists(path):
+            raise CommandError('No such file: %s' % path)
+        done = self.resumed_from = self.read_checkpoint() if options['resume'] else 0
+        self.created = self.skipped = self.bad = 0
+        start = time.perf_counter()
+
+        with io.open(path, encoding='utf-8', newline='') as file:
+            batch = []
+            for number, row in enumerate(read_rows(file, format), 1):
+                if number <= done:
+                    continue
+                try:
+                    batch.append(member_from_row(row, options['hash_plaintext']))
+                except BadRow as e:
+                    self.bad += 1
+                    self.stderr.write('Row %d: %s' % (number, e))
+                if number - done >= batch_size:
+                    self.insert(batch)
+                    done = number
+                    self.write_checkpoint(done)
+                    batch = []
+                    self.report(done, start)
+            self.insert(batch)
+
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Imported %d members, skipped %d already registered, '
+                          '%d bad rows in %.1fs (%.0f rows/s)'
+                          % (self.created, self.skipped, self.bad, elapsed,
+                             (self.created + self.skipped + self.bad) / (elapsed or 1)))
+
+    def insert(self, members):
+        # Drop rows whose email is already taken, in the database or earlier
+        # in this batch, so that one duplicate doesn't fail the whole batch.
+        if not members:
+            return
+        with transaction.atomic():
+            keys = [m.email_key for m in members]
+            taken = set(Member.objects.filter(email_key__in=keys)
+                        .values_list('email_key', flat=True))
+            new = []
+            for member in members:
+                if member.email_key in taken:
+                    self.skipped += 1
+                else:
+                    taken.add(member.email_key)
+                    new.append(member)
+            Member.objects.bulk_create(new)
+        self.created += len(new)
+
+    def report(self, done, start):
+        if self.verbosity >= 2:
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%d rows, %.0f rows/s'
+                              % (done, (done - self.resumed_from) / (elapsed or 1)))
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint) as file:
+                return int(file.read())
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            raise CommandError('Checkpoint file %s is corrupt' % self.checkpoint)
+
+    def write_checkpoint(self, done):
+        # Written to a temporary file and renamed, so an interrupted import
+        # never leaves a half-written checkpoint.
+        temp = self.checkpoint + '.tmp'
+        with open(temp, 'w') as file:
+            file.write(str(done))
+        os.replace(temp, self.checkpoint)
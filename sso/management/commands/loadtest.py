@@ -0,0 +1,95 @@
+import threading
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import override_settings
+from sso import jwks
+from sso.bench import scratch_database
+from sso.loadtest import LoadTest, LocalServer, QueryCounter, Recorder, SmtpSink
+from sso.mail import send_queued_mail
+from sso.stubprovider import StubProvider
+
+
+class Command(BaseCommand):
+    help = ('Load-tests the full sign-up, verify and sign-in flow, plus the '
+            'OAuth callbacks, against a local server with a scratch database, '
+            'an SMTP sink and stub providers.  Reports requests/s, latency '
+            'percentiles and SQL queries per step.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10,
+                            help='Simulated users running flows at once.')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='Flows each user runs.')
+        parser.add_argument('--no-callbacks', action='store_false', dest='callbacks',
+                            help="Skip the OAuth provider callbacks.")
+        parser.add_argument('--provider-delay', type=float, default=0.0,
+                            help='Seconds the stub provider takes per call.')
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='Keep the sign-in/sign-up rate limits on.  '
+                                 'All simulated users share one IP.')
+
+    def handle(self, *args, **options):
+        stub = StubProvider(delay=options['provider_delay'])
+        stub.start()
+        sink = SmtpSink()
+        sink.start()
+        overrides = {
+            'ALLOWED_HOSTS': ['*'],
+            'DEBUG': False,
+            'SSO_PROVIDER_URLS': stub.provider_urls(),
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': sink.port,
+        }
+        if not options['rate_limits']:
+            overrides['SSO_RATE_LIMIT'] = {'RATES': {
+                'signin-ip': None, 'signin-email': None,
+                'signup-ip': None, 'signup-email': None}}
+
+        jwks.google_discovery.clear()
+        jwks.google_keys.clear()
+        try:
+            with override_settings(**overrides):
+                with scratch_database(options['verbosity']):
+                    self.run(sink, options)
+        finally:
+            sink.stop()
+            stub.stop()
+
+    def run(self, sink, options):
+        app = QueryCounter(get_wsgi_application())
+        server = LocalServer(app)
+        server.start()
+        stop_mail = threading.Event()
+        mailer = threading.Thread(target=self.deliver_mail, args=(stop_mail,))
+        mailer.start()
+
+        recorder = Recorder()
+        test = LoadTest(server.url, sink, recorder, options['callbacks'])
+        self.stdout.write('Running %d users x %d flows against %s...'
+                          % (options['users'], options['iterations'], server.url))
+        try:
+            elapsed = test.run(options['users'], options['iterations'])
+        finally:
+            stop_mail.set()
+            mailer.join()
+            server.stop()
+
+        for line in recorder.report(elapsed, app.counts):
+            self.stdout.write(line)
+        requests = sum(len(s) for step, s in recorder.samples.items()
+                       if step != 'mail delivery')
+        self.stdout.write('%d flows (%d failed) in %.1fs: %.1f flows/s, %.1f requests/s'
+                          % (test.flows, test.failed_flows, elapsed,
+                             test.flows / elapsed, requests / elapsed))
+
+    def deliver_mail(self, stop):
+        # A stand-in for `manage.py send_queued_mail --loop`.
+        try:
+            while not stop.is_set():
+                sent, failed = send_queued_mail()
+                if not sent and not failed:
+                    stop.wait(0.02)
+        finally:
+            connection.close()
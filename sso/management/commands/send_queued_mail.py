@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from sso.mail import send_queued_mail, MAIL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delivers mail waiting on the outbound queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MAIL_BATCH_SIZE,
+                            help='Messages to send per SMTP connection.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling the queue for new mail.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty '
+                                 '(with --loop).')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued_mail(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write('Sent %d, failed %d' % (sent, failed))
+
+            # A full batch means there's probably more waiting, so go again
+            # straight away.
+            if sent + failed >= options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write('Done: %d sent, %d failed' % (total_sent, total_failed))
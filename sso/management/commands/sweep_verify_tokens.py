@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from sso.models import VerifyEmail, SWEEP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Deletes expired email verify tokens in small batches.  Safe to '
+            'run every minute from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                            help='Tokens to delete per statement.')
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--max-runtime', type=float, default=50.0,
+                            help='Stop after this many seconds even if there '
+                                 'are expired tokens left.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        start = time.time()
+        deadline = start + options['max_runtime']
+        total = batches = 0
+
+        while True:
+            deleted = VerifyEmail.sweep(batch_size)
+            total += deleted
+            batches += 1
+            if options['verbosity'] >= 2:
+                self.stdout.write('Batch %d: deleted %d (%d so far)'
+                                  % (batches, deleted, total))
+
+            if deleted < batch_size:
+                finished = True
+                break
+            if time.time() + options['sleep'] >= deadline:
+                finished = False
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write('Deleted %d expired tokens in %d batches (%.1fs)%s'
+                          % (total, batches, time.time() - start,
+                             '' if finished else '; stopped at max runtime'))
@@ -0,0 +1,174 @@
+"""
+Reading and writing members as CSV or JSON Lines, for the import_members and
+export_members commands.
+
+Both formats use the same fields.  `password` holds the stored hash (any
+format listed in PASSWORD_HASHERS), so members move between systems without
+their passwords ever being known or rehashed here.  A blank (or unusable)
+password makes an account that can't sign in with a password.
+"""
+import csv
+import json
+from django.contrib.auth.hashers import (
+    UNUSABLE_PASSWORD_PREFIX, identify_hasher, make_password)
+from .models import Member, email_key
+
+
+FIELDS = ['email', 'short_name', 'full_name', 'password', 'is_active',
+          'is_admin', 'roles']
+
+FORMATS = ('csv', 'jsonl')
+
+# The range of Member.roles, a PositiveSmallIntegerField.
+MAX_ROLES = 32767
+
+
+class BadRow(ValueError):
+    pass
+
+
+def guess_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+def read_rows(file, format):
+    """
+    Yields one dict per member from an open file, one row at a time.  A JSON
+    line that isn't an object is yielded as a BadRow instead, so that the
+    rest of the file can still be read; member_from_row() raises it.
+    """
+    if format == 'csv':
+        for row in csv.DictReader(file):
+            yield row
+    else:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield BadRow('line %d: invalid JSON (%s)' % (number, e))
+                continue
+            if not isinstance(row, dict):
+                yield BadRow('line %d: not a JSON object' % number)
+                continue
+            yield row
+
+
+class RowWriter(object):
+
+    def __init__(self, file, format):
+        self.file = file
+        self.format = format
+        if format == 'csv':
+            self.writer = csv.DictWriter(file, FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+
+
+def to_bool(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+
+def text_field(row, field):
+    """
+    Returns row[field] stripped, or '' if it's missing.  (JSON rows can hold
+    numbers or lists where text belongs.)
+    """
+    value = row.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise BadRow('%s is not text: %r' % (field, value))
+    return value.strip()
+
+
+def check_length(field, value):
+    max_length = Member._meta.get_field(field).max_length
+    if len(value) > max_length:
+        raise BadRow('%s is longer than %d characters: %r' % (field, max_length, value))
+
+
+def roles_field(row, email):
+    """
+    Returns row['roles'] as an int, 0 if it's blank.  Anything else that
+    isn't a whole number in range, e.g. 1.5, is a BadRow.
+    """
+    value = row.get('roles')
+    if value in (None, ''):
+        return 0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, str):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            pass
+    if isinstance(value, bool) or not isinstance(value, int) \
+            or not 0 <= value <= MAX_ROLES:
+        raise BadRow('invalid roles for %s: %r' % (email, row.get('roles')))
+    return value
+
+
+def member_from_row(row, hash_plaintext=False):
+    """
+    Builds an unsaved Member from an imported row.  Raises BadRow if the row
+    can't be used.
+    """
+    if isinstance(row, BadRow):
+        raise row
+    email = text_field(row, 'email')
+    if '@' not in email:
+        raise BadRow('invalid email %r' % email)
+    short_name = text_field(row, 'short_name')
+    if not short_name:
+        raise BadRow('missing short_name for %s' % email)
+
+    password = text_field(row, 'password') or None
+    if password is None or password.startswith(UNUSABLE_PASSWORD_PREFIX):
+        password = make_password(None)
+    elif not is_hash(password):
+        if not hash_plaintext:
+            raise BadRow('password for %s is not a recognized hash' % email)
+        password = make_password(password)
+
+    email = Member.objects.normalize_email(email)
+    full_name = text_field(row, 'full_name')
+    # Checked here, or one bad row would fail its whole batch's insert.
+    check_length('email', email)
+    check_length('short_name', short_name)
+    check_length('full_name', full_name)
+    return Member(
+        email=email,
+        email_key=email_key(email),
+        short_name=short_name,
+        full_name=full_name,
+        password=password,
+        is_active=to_bool(row.get('is_active'), True),
+        is_admin=to_bool(row.get('is_admin'), False),
+        roles=roles_field(row, email),
+    )
+
+
+def is_hash(password):
+    try:
+        identify_hasher(password)
+    except ValueError:
+        return False
+    return True
+
+
+def member_to_row(values):
+    """
+    Turns a values() dict of FIELDS into an exported row.
+    """
+    return {field: values[field] for field in FIELDS}
@@ -0,0 +1,268 @@
+"""
+In-process metrics, served at /metrics in the Prometheus text format.
+
+What's recorded:
+
+    sso_requests_total{view,method,status}     counter
+    sso_request_seconds{view}                  histogram, whole request
+    sso_request_queries{view}                  histogram, SQL queries per request
+    sso_request_dependency_seconds{view,dependency}
+                                               histogram, time per request spent
+                                               in db, http, mail and hashing
+    sso_db_query_seconds{alias}                histogram, each SQL statement
+    sso_http_request_seconds{provider,status}  histogram, each provider call
+    sso_mail_send_seconds{result}              histogram, each message sent
+    sso_password_hash_seconds{op}              histogram, each hash or check
+
+plus whatever collectors report at scrape time (e.g. hash pool stats).
+
+MetricsMiddleware times requests; the database cursors are wrapped when
+connections open (see signals.py), and providers.py, mail.py and
+hashpool.py time their own calls with timer().  Each observation is a
+perf_counter() call, a bisect and a dict update under a lock.
+
+Counts live in the process that served the request, so with several worker
+processes each has its own; scrape each one, or sum them downstream.
+settings.SSO_METRICS_ALLOWED_IPS lists who may read /metrics.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+
+# Latency buckets in seconds, from a fast cache hit to a slow provider.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+DEPENDENCIES = ('db', 'http', 'mail', 'hash')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+             for name, value in zip(names, values))
+    return '{%s}' % ','.join(pairs)
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        # As strings, so that e.g. 200 and 'error' sort together.
+        labelvalues = tuple(map(str, labelvalues))
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield self.name, format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [count per bucket (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        labelvalues = tuple(map(str, labelvalues))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        names = self.labelnames + ('le',)
+        for labelvalues, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       format_labels(names, labelvalues + (bound,)), cumulative)
+            labels = format_labels(self.labelnames, labelvalues)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def register_collector(self, collect):
+        """
+        collect() is called at scrape time and returns an iterable of
+        (name, type, help, [(labels dict, value), ...]).
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend('%s%s %s' % sample for sample in metric.samples())
+        for collect in self._collectors:
+            for name, type, help, samples in collect():
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, type))
+                for labels, value in samples:
+                    lines.append('%s%s %s' % (name, format_labels(
+                        sorted(labels), [labels[k] for k in sorted(labels)]), value))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'sso_requests_total', 'Requests served.', ('view', 'method', 'status'))
+request_seconds = registry.histogram(
+    'sso_request_seconds', 'Time to serve a request.', ('view',))
+request_queries = registry.histogram(
+    'sso_request_queries', 'SQL queries per request.', ('view',), COUNT_BUCKETS)
+request_dependency_seconds = registry.histogram(
+    'sso_request_dependency_seconds',
+    'Time per request spent waiting on each dependency.', ('view', 'dependency'))
+db_query_seconds = registry.histogram(
+    'sso_db_query_seconds', 'Time per SQL statement.', ('alias',))
+http_request_seconds = registry.histogram(
+    'sso_http_request_seconds', 'Time per call to an OAuth provider.',
+    ('provider', 'status'))
+mail_send_seconds = registry.histogram(
+    'sso_mail_send_seconds', 'Time per message sent.', ('result',))
+password_hash_seconds = registry.histogram(
+    'sso_password_hash_seconds', 'Time per password hash or check.', ('op',))
+
+
+# Per-request totals, so that a request's own SQL, HTTP, mail and hashing
+# time can be recorded against its view.
+_request = threading.local()
+
+
+def _add_dependency_time(dependency, seconds):
+    totals = getattr(_request, 'totals', None)
+    if totals is not None:
+        totals[dependency] += seconds
+
+
+@contextmanager
+def timer(histogram, dependency, *labelvalues):
+    """
+    Times the block into histogram, and into the current request's total
+    for dependency ('db', 'http', 'mail' or 'hash').  Extra labels can be
+    added to the list the block gets, e.g. a status only known afterwards.
+    """
+    labels = list(labelvalues)
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, *labels)
+        _add_dependency_time(dependency, elapsed)
+
+
+class TimedCursorMixin(object):
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursorMixin, self).execute(sql, params)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursorMixin, self).executemany(sql, param_list)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _record(self, elapsed):
+        db_query_seconds.observe(elapsed, self.db.alias)
+        _add_dependency_time('db', elapsed)
+        if getattr(_request, 'totals', None) is not None:
+            _request.queries += 1
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    connection_created handler (see signals.py): times this connection's
+    queries.  Django 1.9 has no hook for wrapping query execution, so the
+    connection's cursor factories are replaced instead.
+    """
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = \
+        lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+
+
+class MetricsMiddleware(object):
+
+    def process_request(self, request):
+        request._metrics_start = time.perf_counter()
+        _request.totals = dict.fromkeys(DEPENDENCIES, 0.0)
+        _request.queries = 0
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        totals = getattr(_request, 'totals', None)
+        if start is None or totals is None:
+            return response
+        elapsed = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+
+        requests_total.inc(view, request.method, response.status_code)
+        request_seconds.observe(elapsed, view)
+        request_queries.observe(_request.queries, view)
+        for dependency, seconds in totals.items():
+            request_dependency_seconds.observe(seconds, view, dependency)
+        _request.totals = None
+        return response
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-17 19:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import sso.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sso', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('to', models.EmailField(max_length=254)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt', models.BigIntegerField(db_index=True, default=sso.models.OutboundMail.next_attempt_default, null=True)),
+            ],
+        ),
+    ]
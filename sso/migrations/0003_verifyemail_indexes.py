@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-17 19:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import sso.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sso', '0002_outboundmail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='verifyemail',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='verifyemail',
+            name='expires',
+            field=models.BigIntegerField(db_index=True, default=sso.models.VerifyEmail.expires_default),
+        ),
+        migrations.AlterIndexTogether(
+            name='verifyemail',
+            index_together=set([('token', 'expires')]),
+        ),
+    ]
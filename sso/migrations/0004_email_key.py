@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def email_key(email):
+    # sso.models.email_key() as it was when this migration was written; kept
+    # here so that the migration doesn't change if that does.  In Python
+    # rather than SQL LOWER(), which on SQLite only folds ASCII.
+    return email.strip().lower()
+
+
+def fill_email_keys(apps, schema_editor):
+    for model_name in ('Member', 'VerifyEmail'):
+        model = apps.get_model('sso', model_name)
+        last_id = 0
+        while True:
+            rows = list(model.objects.filter(id__gt=last_id).order_by('id')
+                        .values_list('id', 'email')[:BATCH_SIZE])
+            if not rows:
+                break
+            for id, email in rows:
+                model.objects.filter(id=id).update(email_key=email_key(email))
+            last_id = rows[-1][0]
+
+    Member = apps.get_model('sso', 'Member')
+    duplicates = (Member.objects.values('email_key')
+                  .annotate(count=models.Count('id')).filter(count__gt=1))
+    if duplicates:
+        raise ValueError(
+            'These addresses belong to more than one member when case is '
+            'ignored; merge or rename them before migrating: %s'
+            % ', '.join(d['email_key'] for d in duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sso', '0003_verifyemail_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='email_key',
+            field=models.CharField(editable=False, max_length=254, null=True),
+        ),
+        migrations.AddField(
+            model_name='verifyemail',
+            name='email_key',
+            field=models.CharField(default='', editable=False, max_length=254),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_email_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='member',
+            name='email_key',
+            field=models.CharField(editable=False, max_length=254, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='verifyemail',
+            name='email_key',
+            field=models.CharField(db_index=True, editable=False, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='verifyemail',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sso', '0004_email_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='member',
+            name='roles',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0),
+        ),
+    ]
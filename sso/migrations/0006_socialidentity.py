@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sso', '0005_member_roles_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocialIdentity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('github', 'GitHub'), ('google', 'Google'), ('facebook', 'Facebook')], max_length=16)),
+                ('subject', models.CharField(max_length=255)),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('linked', models.DateTimeField(auto_now_add=True)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='social_identities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'social identities',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='socialidentity',
+            unique_together=set([('provider', 'subject')]),
+        ),
+    ]
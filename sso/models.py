@@ -1,9 +1,13 @@
-from django.db import models, IntegrityError
+from django.conf import settings
+from django.db import connections, models, IntegrityError
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
+from django.core import signing
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
+from . import hashpool
+import os
 import string
-import random
+import threading
 import time
 import re
 
@@ -12,7 +16,109 @@ import re
 # Member management section
 # =========================
 
-class MemberManager(BaseUserManager):
+def email_key(email):
+    """
+    The form of an email address used for lookups, so that Sam@Example.com
+    and sam@example.com find the same member.  Member.email keeps the
+    address as the member typed it.
+    """
+    return email.strip().lower()
+
+
+def has_recursive_cte(connection):
+    # MySQL only has WITH RECURSIVE from 8.0, and Django 1.9 supports 5.5 on.
+    return connection.vendor != 'mysql'
+
+
+class MemberQuerySet(models.QuerySet):
+
+    def is_registered(self, email):
+        """
+        Returns True if the email is registered in the member database.
+        """
+        return self.filter(email_key=email_key(email)).exists()
+
+    def with_email_prefix(self, prefix):
+        """
+        Members whose email starts with prefix, ignoring case, found through
+        the email_key index.
+        """
+        prefix = email_key(prefix)
+        if connections[self.db].vendor == 'sqlite':
+            # SQLite's LIKE ignores case, so it can't use the (case-sensitive)
+            # index; a range over the index gives the same rows.
+            return self.filter(email_key__gte=prefix,
+                               email_key__lt=prefix + '\U0010ffff')
+        # PostgreSQL and MySQL index LIKE 'prefix%' directly.
+        return self.filter(email_key__startswith=prefix)
+
+    def _role_values_sql(self, condition):
+        """
+        SQL for the distinct values of roles that match condition, a
+        template on {value}.
+
+        Rather than reading the whole roles index, this hops from each value
+        to the next larger one (a "loose index scan"), so it costs one index
+        probe per distinct value, and there are only ever a handful.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table, roles = qn(self.model._meta.db_table), qn('roles')
+        if not has_recursive_cte(connection):
+            return 'SELECT DISTINCT {roles} FROM {table} WHERE {condition}'.format(
+                roles=roles, table=table, condition=condition.format(value=roles))
+        return (
+            'WITH RECURSIVE role_values(value) AS ('
+            ' SELECT MIN({roles}) FROM {table}'
+            ' UNION ALL'
+            ' SELECT (SELECT MIN({roles}) FROM {table} WHERE {roles} > value)'
+            ' FROM role_values WHERE value IS NOT NULL'
+            ') SELECT value FROM role_values'
+            ' WHERE value IS NOT NULL AND {condition}'
+        ).format(table=table, roles=roles, condition=condition.format(value='value'))
+
+    def role_values(self):
+        """
+        Returns the distinct values of roles in the table.
+        """
+        connection = connections[self.db]
+        if not has_recursive_cte(connection):
+            return list(self.model._default_manager.using(self.db).order_by('roles')
+                        .values_list('roles', flat=True).distinct())
+        with connection.cursor() as cursor:
+            cursor.execute(self._role_values_sql('1 = 1'))
+            return [row[0] for row in cursor.fetchall()]
+
+    # roles & mask can't use an index, so these find the roles values in use
+    # that match the mask, in a subquery, and filter with roles IN (...).
+    # That costs one index lookup per matching value plus the rows found.
+    # The subquery runs with the main query, so building these is free.
+    def with_any_role(self, role):
+        """
+        Members that have any of the roles in the bitmask.
+        """
+        return self._with_role_values('{value} & %s != 0', [role])
+
+    def with_all_roles(self, roles):
+        """
+        Members that have all of the roles in the bitmask.
+        """
+        return self._with_role_values('{value} & %s = %s', [roles, roles])
+
+    def _with_role_values(self, condition, params):
+        # Not filter(roles__in=RawSQL(...)): that parenthesizes the subquery
+        # twice, which SQLite reads as a scalar, i.e. its first row only.
+        qn = connections[self.db].ops.quote_name
+        column = '%s.%s' % (qn(self.model._meta.db_table), qn('roles'))
+        return self.extra(where=['%s IN (%s)' % (column, self._role_values_sql(condition))],
+                          params=params)
+
+
+class MemberManager(BaseUserManager.from_queryset(MemberQuerySet)):
+
+    def get_by_natural_key(self, email):
+        # Used by authenticate(), so sign-in matches the email in any case.
+        return self.get(email_key=email_key(email))
 
     def create_user(self, email, short_name, password=None, full_name=''):
         """
@@ -46,17 +152,13 @@ class MemberManager(BaseUserManager):
         member.save(using=self._db)
         return member
 
-    def is_registered(self, email):
-        """
-        Returns True if the email is registered in the member database.
-        """
-        return self.filter(email=email).count() > 0
-
 
 class Member(AbstractBaseUser):
 
     # Members are identified by email address.
     email = models.EmailField(max_length=254, unique=True)
+    # All lookups by email go through this instead; see email_key().
+    email_key = models.CharField(max_length=254, unique=True, editable=False)
 
     # By default, we require only a short_name used for greeting,
     # as in "Hi, <name>."
@@ -75,21 +177,22 @@ class Member(AbstractBaseUser):
     # This is a bit field to keep track of other roles that the member has,
     # e.g. staff, teacher, gold member.  (This is in place of using the
     # groups function, which is overkill for most of our projects.)
-    roles = models.PositiveSmallIntegerField(default=0)
+    # Indexed for MemberQuerySet.with_any_role() and with_all_roles().
+    roles = models.PositiveSmallIntegerField(default=0, db_index=True)
 
     def has_role(self, role):
         """
         Returns True if this member has any of the roles requested.
         Parameter role is a bitmask.
         """
-        return bool(roles & role)
+        return bool(self.roles & role)
 
     def has_roles(self, roles):
         """
         Returns True if the member has all of the roles requested.
         Parameter role is a bitmask.
         """
-        return roles & role == roles
+        return self.roles & roles == roles
 
     # These are used by django admin.
     USERNAME_FIELD = 'email'
@@ -97,28 +200,101 @@ class Member(AbstractBaseUser):
 
     objects = MemberManager()
 
+    def save(self, *args, **kwargs):
+        self.email_key = email_key(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'email_key'}
+        super(Member, self).save(*args, **kwargs)
+
     def get_full_name(self):
         return self.full_name or self.short_name
 
     def get_short_name(self):
         return self.short_name
 
-    # TODO: do we need these?
-    # @property
-    # def is_staff(self):
-    #     "Is the member staff?"
-    #     return self.is_admin
+    # Hashing goes through hashpool so it can run off the request thread.
+    # Either may raise hashpool.HashPoolSaturated.
+    def set_password(self, raw_password):
+        self.password = hashpool.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        def setter(raw_password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return hashpool.check_password(raw_password, self.password, setter)
+
+    # The admin site needs these.  Admins can do everything there, and no
+    # one else can get in.
+    @property
+    def is_staff(self):
+        "Is the member staff?"
+        return self.is_admin
+
+    def has_perm(self, perm, obj=None):
+        "Does the member have a specific permission?"
+        return self.is_active and self.is_admin
+
+    def has_module_perms(self, app_label):
+        "Does the member have permissions to view the app `app_label`?"
+        return self.is_active and self.is_admin
+
+    def __str__(self):
+        return self.email
 
-    # def has_perm(self, perm, obj=None):
-    #     "Does the member have a specific permission?"
-    #     return True
 
-    # def has_module_perms(self, app_label):
-    #     "Does the member have permissions to view the app `app_label`?"
-    #     return True
+# ==============================
+# Linked social identity section
+# ==============================
+
+class SocialIdentity(models.Model):
+    """
+    A GitHub, Google or Facebook account linked to a member, by the
+    provider's own id for the account (which, unlike the email address,
+    never changes).  A returning social sign-in finds its member with one
+    lookup on the unique (provider, subject) index.
+    """
+    PROVIDERS = (
+        ('github', 'GitHub'),
+        ('google', 'Google'),
+        ('facebook', 'Facebook'),
+    )
+
+    member = models.ForeignKey(Member, on_delete=models.CASCADE,
+                               related_name='social_identities')
+    provider = models.CharField(max_length=16, choices=PROVIDERS)
+    # The provider's user id: GitHub's id, Google's sub, Facebook's id.
+    subject = models.CharField(max_length=255)
+    # The email the provider gave when the account was linked, for reference.
+    email = models.EmailField(max_length=254, blank=True)
+    linked = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('provider', 'subject')]
+        verbose_name_plural = 'social identities'
+
+    @classmethod
+    def member_for(cls, provider, subject):
+        """
+        Returns the member linked to the provider's account subject, or None.
+        """
+        identity = (cls.objects.select_related('member')
+                    .filter(provider=provider, subject=subject).first())
+        return identity.member if identity is not None else None
+
+    @classmethod
+    def link(cls, member, provider, subject, email=''):
+        """
+        Links the provider's account subject to member.  Raises
+        IntegrityError if it's already linked.
+        """
+        return cls.objects.create(member=member, provider=provider,
+                                  subject=subject, email=email)
 
     def __str__(self):
-        return self.email
+        return '%s:%s' % (self.provider, self.subject)
 
 
 # ==========================
@@ -135,11 +311,84 @@ EMAIL_TOKEN_LENGTH = 64
 # up to ten extra minutes to complete the signup process.
 SIGNUP_GRACE_TIME = 10 * 60
 
+# Expired tokens are cleaned out this many at a time.
+SWEEP_BATCH_SIZE = 1000
+
+# In signed token mode (settings.SSO_VERIFY_TOKENS = 'signed') nothing is
+# stored: the token is the email address plus issue time, signed with
+# SECRET_KEY.
+SIGNED_TOKEN_SALT = 'sso.VerifyEmail'
+
+
+def signed_tokens():
+    return getattr(settings, 'SSO_VERIFY_TOKENS', 'db') == 'signed'
+
+
+# Tokens are drawn from the OS random source in bulk.  Each random byte is
+# mapped onto a letter or digit with bytes.translate(); the top eight byte
+# values are thrown away so that all 62 characters are equally likely.
+TOKEN_ALPHABET = (string.ascii_letters + string.digits).encode('ascii')
+_TOKEN_TABLE = bytes(TOKEN_ALPHABET[i % len(TOKEN_ALPHABET)] for i in range(256))
+_TOKEN_DISCARD = bytes(range(256 - 256 % len(TOKEN_ALPHABET), 256))
+
 
-# Generate a random toke
+def random_token_chars(count):
+    """
+    Returns a string of count random letters and digits.
+    """
+    chars = b''
+    while len(chars) < count:
+        # Ask for a little extra to cover the discarded bytes.
+        needed = count - len(chars)
+        chars += os.urandom(needed + needed // 16 + 8).translate(
+            _TOKEN_TABLE, _TOKEN_DISCARD)
+    return chars[:count].decode('ascii')
+
+
+class TokenPool(object):
+    """
+    A pool of pre-generated tokens, refilled in bulk when it runs dry, so a
+    burst of sign-ups costs one trip to the OS random source rather than
+    one per token.  Safe to share between threads.
+    """
+
+    def __init__(self, size, length=EMAIL_TOKEN_LENGTH):
+        self.size = size
+        self.length = length
+        self._tokens = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def fill(self):
+        """
+        Tops the pool up to its full size.
+        """
+        with self._lock:
+            self._fill()
+
+    def _fill(self):
+        # A forked child must not hand out the same tokens as its parent.
+        if self._pid != os.getpid():
+            self._tokens = []
+            self._pid = os.getpid()
+        missing = self.size - len(self._tokens)
+        chars = random_token_chars(missing * self.length)
+        self._tokens.extend(chars[i:i + self.length]
+                            for i in range(0, len(chars), self.length))
+
+    def get(self):
+        with self._lock:
+            if not self._tokens or self._pid != os.getpid():
+                self._fill()
+            return self._tokens.pop()
+
+
+token_pool = TokenPool(getattr(settings, 'SSO_TOKEN_POOL_SIZE', 256))
+
+
+# Generate a random token
 def create_token():
-    return ''.join(random.choice(string.ascii_letters + string.digits)
-                   for _ in range(EMAIL_TOKEN_LENGTH))
+    return token_pool.get()
 
 
 class VerifyEmail(models.Model):
@@ -147,13 +396,27 @@ class VerifyEmail(models.Model):
     Class VerifyEmail generates random tokens that are associated with email
     addresses.  The tokens may then be mailed to the email address to verify
     that the user owns the address.
+
+    With settings.SSO_VERIFY_TOKENS = 'signed', tokens are self-contained
+    signed values instead, and generating or redeeming them never touches
+    the database.
     """
     email = models.EmailField()
+    email_key = models.CharField(max_length=254, db_index=True, editable=False)
     token = models.CharField(max_length=EMAIL_TOKEN_LENGTH, unique=True)
 
     def expires_default():
         return int(time.time()) + EMAIL_TOKEN_VALIDITY
-    expires = models.BigIntegerField(default=expires_default)
+    expires = models.BigIntegerField(default=expires_default, db_index=True)
+
+    class Meta:
+        # redeem_token() looks up by token and expiry together; remove() goes
+        # by email_key and cron() by expiry alone.
+        index_together = [('token', 'expires')]
+
+    def save(self, *args, **kwargs):
+        self.email_key = email_key(self.email)
+        super(VerifyEmail, self).save(*args, **kwargs)
 
     @classmethod
     def generate_token(cls, email):
@@ -161,6 +424,9 @@ class VerifyEmail(models.Model):
         Generate an email verify token.  This token should then be emailed to
         the user as part of a verify link.
         """
+        if signed_tokens():
+            return signing.dumps(email, salt=SIGNED_TOKEN_SALT, compress=True)
+
         done = False
         while not done:
             token = create_token()
@@ -180,6 +446,18 @@ class VerifyEmail(models.Model):
         This should be called when a user clicks on a link in their email.
         Returns None if the token is not valid.
         """
+        if signed_tokens():
+            # A signed token can't have its expiry pushed back, so instead
+            # the grace period is added on at the end of its life.  This
+            # still gives the user at least SIGNUP_GRACE_TIME after clicking
+            # the link to finish signing up.
+            try:
+                return signing.loads(
+                    token, salt=SIGNED_TOKEN_SALT,
+                    max_age=EMAIL_TOKEN_VALIDITY + SIGNUP_GRACE_TIME)
+            except signing.BadSignature:
+                return None
+
         now = int(time.time())
         ve = cls.objects.filter(token=token, expires__gte=now).first()
         if ve is None:
@@ -200,17 +478,137 @@ class VerifyEmail(models.Model):
         This should be called when a user finishes registration and signs in,
         as it's no longer necessary to verify their email.
         """
-        cls.objects.filter(email=email).delete()
+        if signed_tokens():
+            # Nothing stored, so nothing to remove.  A leftover token is
+            # harmless because verify refuses registered addresses.
+            return
+        cls.objects.filter(email_key=email_key(email)).delete()
+
+    @classmethod
+    def sweep(cls, batch_size=SWEEP_BATCH_SIZE):
+        """
+        Deletes up to batch_size expired tokens, oldest first, and returns the
+        number deleted.  Keeping each delete small means we never hold a long
+        write lock while sign-ups are trying to insert.
+        """
+        now = int(time.time())
+        expired = cls.objects.filter(expires__lt=now)
+        ids = list(expired.order_by('expires')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        # Re-check the expiry in case redeem_token() extended one meanwhile.
+        deleted, _ = expired.filter(id__in=ids).delete()
+        return deleted
 
     @classmethod
     def cron(cls):
         """
         Call this regularly to clean out unused tokens.
+        (See also the sweep_verify_tokens management command.)
         """
-        cls.objects.filter(expires__lt=int(time.time())).delete()
+        while cls.sweep() == SWEEP_BATCH_SIZE:
+            pass
 
     def __str__(self):
         return self.email + ' expires ' + \
             time.strftime('%H:%M', time.gmtime(self.expires))
 
 
+# =====================
+# Outbound mail section
+# =====================
+
+# Mail that fails to send is retried with exponential backoff: one minute
+# after the first failure, then two, four, ... up to an hour between tries.
+MAIL_RETRY_DELAY = 60
+MAIL_RETRY_DELAY_MAX = 3600
+
+# A worker claims a message by pushing its next attempt this far ahead
+# before sending it, so other workers leave it alone.  If the worker dies
+# mid-send, the message is retried once the lease runs out.
+MAIL_LEASE = 300
+
+# After this many failed attempts we give up on a message.  The row is kept
+# (with next_attempt cleared) so that the failure can be investigated.
+MAIL_MAX_ATTEMPTS = 8
+
+
+class OutboundMail(models.Model):
+    """
+    Class OutboundMail is a persistent queue of mail waiting to be sent.
+    Views enqueue messages here instead of talking to the SMTP server
+    directly, and the send_queued_mail management command delivers them
+    in batches.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.EmailField()
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    # The time (unix seconds) when the message is next due to be sent.
+    # None means that we've given up on it.
+    def next_attempt_default():
+        return int(time.time())
+    next_attempt = models.BigIntegerField(null=True, db_index=True,
+                                          default=next_attempt_default)
+
+    @classmethod
+    def enqueue(cls, subject, body, from_email, recipient_list):
+        """
+        Queue a message for each recipient.  Returns once the rows have been
+        written; nothing is sent at this point.
+        """
+        cls.objects.bulk_create([
+            cls(subject=subject, body=body, from_email=from_email, to=to)
+            for to in recipient_list
+        ])
+
+    @classmethod
+    def due(cls, limit):
+        """
+        Returns up to limit messages that are ready to be sent, oldest first.
+        """
+        now = int(time.time())
+        return list(cls.objects.filter(next_attempt__lte=now)
+                    .order_by('next_attempt', 'id')[:limit])
+
+    def claim(self):
+        """
+        Call this before sending.  Returns False if another worker has
+        claimed (or sent) the message since due() returned it.
+        """
+        leased_until = int(time.time()) + MAIL_LEASE
+        claimed = OutboundMail.objects.filter(
+            pk=self.pk, next_attempt=self.next_attempt,
+        ).update(next_attempt=leased_until)
+        if claimed:
+            self.next_attempt = leased_until
+        return claimed == 1
+
+    def sent(self):
+        """
+        Call this once the message has been handed to the mail server.
+        """
+        self.delete()
+
+    def failed(self, error):
+        """
+        Call this when sending fails.  Schedules the next attempt, or gives
+        up once MAIL_MAX_ATTEMPTS is reached.
+        """
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= MAIL_MAX_ATTEMPTS:
+            self.next_attempt = None
+        else:
+            delay = min(MAIL_RETRY_DELAY * 2 ** (self.attempts - 1),
+                        MAIL_RETRY_DELAY_MAX)
+            self.next_attempt = int(time.time()) + delay
+        self.save()
+
+    def __str__(self):
+        return self.to + ': ' + self.subject
@@ -0,0 +1,178 @@
+"""
+A sampling profiler for slow requests.
+
+With settings.SSO_PROFILER['ENABLED'] on, ProfilerMiddleware registers each
+request with a background thread, which every INTERVAL seconds looks at the
+stacks of the requests that have been running for longer than THRESHOLD
+(or from the start, for the SAMPLE_RATE fraction of requests picked at
+random).  Fast requests are never walked, so they cost a dict insert and
+delete.  When a request that was sampled finishes, its stacks are appended
+in the collapsed ("folded") format to
+
+    DIR/<view name>.<pid>.folded
+
+one "frame;frame;...;frame count" line per distinct stack, frames being
+module:function, outermost first.  That's what flamegraph.pl and speedscope
+read; `manage.py aggregate_profiles` merges the files.
+
+    SSO_PROFILER = {
+        'ENABLED': False,
+        'THRESHOLD': 0.5,       # seconds before a request is sampled
+        'SAMPLE_RATE': 0.0,     # fraction of requests sampled throughout
+        'INTERVAL': 0.005,      # seconds between samples
+        'DIR': 'profiles',
+    }
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+DEFAULT_PROFILER = {
+    'ENABLED': False,
+    'THRESHOLD': 0.5,
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'DIR': 'profiles',
+}
+
+# Frames deeper than this are cut off at the root end.
+MAX_DEPTH = 200
+
+
+def profiler_options():
+    options = DEFAULT_PROFILER.copy()
+    options.update(getattr(settings, 'SSO_PROFILER', {}))
+    return options
+
+
+def fold(frame):
+    """
+    Returns frame's stack as 'module:function;...', outermost first.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append('%s:%s' % (frame.f_globals.get('__name__', '?'), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile_path(directory, view):
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', view)
+    return os.path.join(directory, '%s.%d.folded' % (name, os.getpid()))
+
+
+class Profile(object):
+
+    def __init__(self, thread_id, sampled):
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.stacks = Counter()
+
+
+class Sampler(object):
+    """
+    Samples the stacks of the threads registered with start(), once they've
+    been running for threshold seconds (or straight away if sampled).
+    """
+
+    def __init__(self, interval=0.005, threshold=0.5):
+        self.interval = interval
+        self.threshold = threshold
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self, sampled=False):
+        profile = Profile(threading.get_ident(), sampled)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            # A forked web worker doesn't inherit its parent's thread.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='sso-profiler')
+                self._thread.start()
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        return profile.stacks
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                now = time.perf_counter()
+                due = [p for p in self._active.values()
+                       if p.sampled or now - p.start >= self.threshold]
+                if not due:
+                    continue
+                frames = sys._current_frames()
+                for profile in due:
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.stacks[fold(frame)] += 1
+            del frames, frame
+
+
+class ProfilerMiddleware(object):
+    """
+    Profiles slow requests, and a sampled fraction of the rest.  Switched
+    off unless SSO_PROFILER['ENABLED'].
+    """
+
+    def __init__(self):
+        options = profiler_options()
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.sample_rate = options['SAMPLE_RATE']
+        self.directory = options['DIR']
+        self.sampler = Sampler(options['INTERVAL'], options['THRESHOLD'])
+        self._lock = threading.Lock()
+
+    def process_request(self, request):
+        sampled = self.sample_rate and random.random() < self.sample_rate
+        request._profile = self.sampler.start(bool(sampled))
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return response
+        stacks = self.sampler.stop(profile)
+        if stacks:
+            match = getattr(request, 'resolver_match', None)
+            self.write(match.view_name if match else 'unresolved', stacks)
+        return response
+
+    def write(self, view, stacks):
+        lines = ''.join('%s %d\n' % item for item in stacks.items())
+        os.makedirs(self.directory, exist_ok=True)
+        # One write per request, so lines from different threads don't mix.
+        with self._lock:
+            with open(profile_path(self.directory, view), 'a') as f:
+                f.write(lines)
+
+
+def read_folded(path):
+    """
+    Yields (stack, count) from a folded file, skipping malformed lines
+    (e.g. the tail of one being written).
+    """
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                yield stack, int(count)
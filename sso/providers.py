@@ -0,0 +1,128 @@
+"""
+Outbound HTTP to the OAuth providers.
+
+Each provider gets one shared requests.Session, so connections are kept
+alive and reused from one callback to the next instead of paying for a new
+TCP and TLS handshake every time.  All calls get connect/read timeouts and
+a retry policy for connection failures, and a circuit breaker per
+provider (see breaker.py) fails calls fast while the provider is down.
+
+Provider base URLs come from settings.SSO_PROVIDER_URLS (falling back to
+the real endpoints below) so that a local stub server can stand in for the
+providers, e.g. during load tests.
+"""
+import threading
+import time
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from . import breaker, metrics
+
+
+DEFAULT_PROVIDER_URLS = {
+    'github': 'https://github.com',
+    'github_api': 'https://api.github.com',
+    'google': 'https://www.googleapis.com',
+    'google_accounts': 'https://accounts.google.com',
+    'facebook': 'https://graph.facebook.com',
+}
+
+DEFAULT_HTTP_OPTIONS = {
+    # Connections kept open per provider host.
+    'POOL_SIZE': 10,
+    # Concurrent connections per provider for the asyncio callbacks
+    # (sso/asgi.py).
+    'ASYNC_POOL_SIZE': 1000,
+    # Seconds to wait for a connection, and then for a response.
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    # Connection failures are retried with backoff (0.2s, 0.4s, ...).  So
+    # are 502/503/504 responses, but only for GET: authorization codes are
+    # single use, so a token exchange POST must not be replayed.
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+}
+
+
+def http_options():
+    options = DEFAULT_HTTP_OPTIONS.copy()
+    options.update(getattr(settings, 'SSO_PROVIDER_HTTP', {}))
+    return options
+
+
+def provider_url(name, path):
+    """
+    Returns the full URL for path on the named provider, e.g.
+    provider_url('github_api', '/user/emails').
+    """
+    urls = getattr(settings, 'SSO_PROVIDER_URLS', {})
+    return urls.get(name, DEFAULT_PROVIDER_URLS[name]).rstrip('/') + path
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session(provider):
+    """
+    Returns the shared, pooled session for talking to provider.
+    requests.Session is safe to share between threads for this kind of use.
+    """
+    try:
+        return _sessions[provider]
+    except KeyError:
+        pass
+
+    with _sessions_lock:
+        if provider not in _sessions:
+            options = http_options()
+            retry = Retry(total=options['RETRIES'],
+                          read=0,
+                          backoff_factor=options['BACKOFF'],
+                          status_forcelist=(502, 503, 504),
+                          method_whitelist=frozenset(['GET']))
+            adapter = HTTPAdapter(pool_connections=options['POOL_SIZE'],
+                                  pool_maxsize=options['POOL_SIZE'],
+                                  max_retries=retry)
+            s = requests.Session()
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            _sessions[provider] = s
+        return _sessions[provider]
+
+
+def request(provider, method, url, **kwargs):
+    """
+    Makes an HTTP request to provider over its pooled session, with the
+    default timeouts unless the caller gives its own.  Raises
+    breaker.CircuitOpen without calling if the provider is failing.
+    """
+    options = http_options()
+    kwargs.setdefault('timeout', (options['CONNECT_TIMEOUT'],
+                                  options['READ_TIMEOUT']))
+    circuit = breaker.circuit(provider)
+    token = circuit.before_call()
+    ok = False
+    start = time.perf_counter()
+    try:
+        with metrics.timer(metrics.http_request_seconds, 'http', provider) as labels:
+            try:
+                response = session(provider).request(method, url, **kwargs)
+            except requests.RequestException:
+                labels.append('error')
+                raise
+            labels.append(response.status_code)
+        ok = response.status_code < 500
+    finally:
+        circuit.record(token, ok, time.perf_counter() - start)
+    return response
+
+
+def get(provider, url, **kwargs):
+    return request(provider, 'GET', url, **kwargs)
+
+
+def post(provider, url, **kwargs):
+    return request(provider, 'POST', url, **kwargs)
+
@@ -0,0 +1,145 @@
+"""
+Rate limits for sign-in and sign-up.
+
+Each limit allows a number of hits per period for one identity (an email
+address or a client IP), counted with a sliding window: the estimate is the
+count in the current fixed window plus the previous window's count weighted
+by how much of it still overlaps the last `period` seconds.  That needs only
+two counters per identity, so it works with any cache that has add/incr.
+
+settings.SSO_RATE_LIMIT configures it:
+
+    SSO_RATE_LIMIT = {
+        'BACKEND': 'local',     # or the name of a cache in settings.CACHES
+        'MAX_SIZE': 100000,     # counters (local backend only)
+        'IP_HEADER': 'REMOTE_ADDR',
+        'RATES': {
+            'signin-ip': (100, 60),         # attempts per IP per minute
+            'signin-email': (10, 900),      # failed sign-ins per email
+            'signup-ip': (20, 3600),
+            'signup-email': (3, 3600),      # verification emails
+        },
+    }
+
+A rate of None switches that limit off.  Like the member cache, a local
+backend counts per process, so with several workers the effective limit is
+multiplied by the number of workers; use a shared cache to avoid that.
+Behind a proxy, set IP_HEADER to the META key that holds the client address
+(e.g. 'HTTP_X_REAL_IP'), and only if the proxy overwrites it.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .cache import LocalLRUCache
+
+
+DEFAULT_RATE_LIMIT = {
+    'BACKEND': 'local',
+    'MAX_SIZE': 100000,
+    'IP_HEADER': 'REMOTE_ADDR',
+    'RATES': {
+        'signin-ip': (100, 60),
+        'signin-email': (10, 900),
+        'signup-ip': (20, 3600),
+        'signup-email': (3, 3600),
+    },
+}
+
+_local_cache = None
+
+
+class RateLimited(Exception):
+
+    def __init__(self, name, retry_after):
+        super(RateLimited, self).__init__('%s rate limit exceeded' % name)
+        self.name = name
+        self.retry_after = retry_after
+
+
+def rate_limit_options():
+    options = DEFAULT_RATE_LIMIT.copy()
+    options.update(getattr(settings, 'SSO_RATE_LIMIT', {}))
+    options['RATES'] = dict(DEFAULT_RATE_LIMIT['RATES'], **options['RATES'])
+    return options
+
+
+def counter_cache():
+    global _local_cache
+    options = rate_limit_options()
+    if options['BACKEND'] != 'local':
+        return caches[options['BACKEND']]
+    if _local_cache is None:
+        _local_cache = LocalLRUCache(options['MAX_SIZE'])
+    return _local_cache
+
+
+def client_ip(request):
+    return request.META.get(rate_limit_options()['IP_HEADER'], '')
+
+
+def _window(name, ident):
+    """
+    Returns (limit, period, previous key, current key, fraction of the
+    current window elapsed), or None if the limit is off.
+    """
+    rate = rate_limit_options()['RATES'].get(name)
+    if rate is None:
+        return None
+    limit, period = rate
+    now = time.time()
+    window = int(now // period)
+    # Hashed, so any email address makes a valid memcached key.
+    ident = hashlib.sha1(ident.lower().encode('utf-8')).hexdigest()
+    key = 'sso.ratelimit.%s.%s.%%d' % (name, ident)
+    return limit, period, key % (window - 1), key % window, (now % period) / period
+
+
+def check(name, ident):
+    """
+    Raises RateLimited if `ident` is already over the `name` limit.
+    """
+    window = _window(name, ident)
+    if window is None:
+        return
+    limit, period, previous, current, elapsed = window
+    counts = counter_cache().get_many([previous, current])
+    estimate = counts.get(previous, 0) * (1 - elapsed) + counts.get(current, 0)
+    if estimate >= limit:
+        raise RateLimited(name, int(period * (1 - elapsed)) + 1)
+
+
+def hit(name, ident):
+    """
+    Counts one hit against the `name` limit for `ident`.
+    """
+    window = _window(name, ident)
+    if window is None:
+        return
+    limit, period, previous, current, elapsed = window
+    cache = counter_cache()
+    # The counter has to outlive its window by a period, while it's the
+    # previous window.
+    cache.add(current, 0, 2 * period)
+    try:
+        cache.incr(current)
+    except ValueError:
+        # Expired or evicted between add() and incr().
+        cache.add(current, 1, 2 * period)
+
+
+def limit(name, ident):
+    """
+    check() then hit(): raises RateLimited if over the limit, and otherwise
+    counts this hit.
+    """
+    check(name, ident)
+    hit(name, ident)
+
+
+def reset():
+    """
+    Forgets all counts in the local backend.  (For tests.)
+    """
+    if _local_cache is not None:
+        _local_cache.clear()
@@ -0,0 +1,100 @@
+"""
+A stateless session engine: the session lives in a signed cookie, so
+authenticated requests need no session table reads or writes.
+
+Use it with SESSION_ENGINE = 'sso.sessions' (or SSO_SESSIONS=signed in the
+environment; see settings.py).
+
+A signed cookie stays valid until it expires, so signing out alone can't
+kill it.  Instead each sign-in gets a random session id, and signing out
+adds that id to a revocation list held in a cache
+(settings.SSO_SESSION_REVOCATION_CACHE, 'default' unless set).
+revoke_member_sessions() signs a member out everywhere.  Use a cache that
+all workers share, or a revocation only applies in the process that made
+it.  Entries only need to outlive the cookie, so they expire after
+SESSION_COOKIE_AGE.
+"""
+import time
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.signed_cookies import \
+    SessionStore as SignedCookieSessionStore
+from django.core.cache import caches
+from django.utils.crypto import get_random_string
+
+
+SESSION_ID_KEY = '_sso_session_id'
+ISSUED_KEY = '_sso_issued'
+
+
+def revocation_cache():
+    return caches[getattr(settings, 'SSO_SESSION_REVOCATION_CACHE', 'default')]
+
+
+def session_revoked_key(session_id):
+    return 'sso.revoked.session.%s' % session_id
+
+
+def member_revoked_key(member_id):
+    return 'sso.revoked.member.%s' % member_id
+
+
+def revoke_session(session_id):
+    revocation_cache().set(session_revoked_key(session_id), True,
+                           settings.SESSION_COOKIE_AGE)
+
+
+def revoke_member_sessions(member_id):
+    """
+    Invalidates every session the member signed in before now.
+    """
+    revocation_cache().set(member_revoked_key(member_id), time.time(),
+                           settings.SESSION_COOKIE_AGE)
+
+
+def is_revoked(session):
+    session_id = session.get(SESSION_ID_KEY)
+    member_id = session.get(SESSION_KEY)
+    if member_id is None:
+        return False
+    if session_id is None:
+        # Signed in without an id, so there'd be no way to revoke it.
+        return True
+
+    keys = [session_revoked_key(session_id), member_revoked_key(member_id)]
+    revoked = revocation_cache().get_many(keys)
+    if revoked.get(keys[0]):
+        return True
+    revoked_before = revoked.get(keys[1])
+    return revoked_before is not None and session.get(ISSUED_KEY, 0) <= revoked_before
+
+
+class SessionStore(SignedCookieSessionStore):
+
+    def load(self):
+        session = super(SessionStore, self).load()
+        if session and is_revoked(session):
+            self.create()
+            return {}
+        return session
+
+    def __setitem__(self, key, value):
+        # login() flushes rather than cycles the session when it belonged to
+        # someone else, so an id is also given whenever a member is set.
+        if key == SESSION_KEY and SESSION_ID_KEY not in self:
+            super(SessionStore, self).__setitem__(SESSION_ID_KEY, get_random_string(24))
+            super(SessionStore, self).__setitem__(ISSUED_KEY, time.time())
+        super(SessionStore, self).__setitem__(key, value)
+
+    def cycle_key(self):
+        # Called by login(): give the new session its own id.
+        self[SESSION_ID_KEY] = get_random_string(24)
+        self[ISSUED_KEY] = time.time()
+        super(SessionStore, self).cycle_key()
+
+    def flush(self):
+        # Called by logout().
+        session_id = self.get(SESSION_ID_KEY)
+        if session_id is not None:
+            revoke_session(session_id)
+        super(SessionStore, self).flush()
@@ -0,0 +1,21 @@
+"""
+Signal handlers, connected when the app is ready (see apps.py).
+"""
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .backends import invalidate_member
+from .db import sqlite_pragmas
+from .metrics import instrument_connection
+from .models import Member
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def member_changed(sender, instance, **kwargs):
+    # Covers password changes, is_active being flipped, etc.
+    invalidate_member(instance.pk)
+
+
+connection_created.connect(sqlite_pragmas)
+connection_created.connect(instrument_connection)
@@ -0,0 +1,161 @@
+"""
+A stand-in for the GitHub, Google and Facebook OAuth endpoints, for tests
+and load tests.  Point settings.SSO_PROVIDER_URLS at it:
+
+    stub = StubProvider()
+    stub.start()
+    SSO_PROVIDER_URLS = stub.provider_urls()
+
+Any authorization code is accepted, and stands for the account with that
+code as its id, so different codes sign in as different accounts.  Set delay
+to simulate a slow provider.
+Google ID tokens are signed with a key generated on the spot, and served
+from the stub's own discovery document and JWKS.
+"""
+import base64
+import json
+import threading
+import time
+import rsa
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+def b64encode(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.respond(self.rfile.read(length).decode('utf-8'))
+
+    def respond(self, body=''):
+        self.server.stub.requests += 1
+        if self.server.stub.delay:
+            time.sleep(self.server.stub.delay)
+
+        url = urlparse(self.path)
+        route = self.server.stub.routes.get(url.path)
+        if route is None:
+            self.send_json(404, {'error': 'not found'})
+        else:
+            params = parse_qs(url.query)
+            params.update(parse_qs(body))
+            self.send_json(200, route(params))
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once.
+    request_queue_size = 1024
+
+
+class StubProvider(object):
+
+    def __init__(self, delay=0, email='stub@example.com'):
+        self.delay = delay
+        self.email = email
+        self.requests = 0
+        self.routes = {
+            '/login/oauth/access_token': lambda q: {
+                'access_token': self.token(q), 'scope': 'user:email'},
+            '/user': lambda q: {
+                'id': self.subject(q), 'login': 'stub', 'name': 'Stub User',
+                'email': None},
+            '/user/emails': lambda q: [
+                {'email': 'other@example.com', 'primary': False, 'verified': True},
+                {'email': self.email, 'primary': True, 'verified': True},
+            ],
+            '/.well-known/openid-configuration': lambda q: {
+                'issuer': 'https://accounts.google.com',
+                'token_endpoint': self.url + '/oauth2/v4/token',
+                'jwks_uri': self.url + '/oauth2/v3/certs'},
+            '/oauth2/v3/certs': lambda q: self.jwks(),
+            '/oauth2/v4/token': lambda q: {
+                'access_token': self.token(q), 'expires_in': 3600,
+                'id_token': self.id_token(q['client_id'][0], q.get('scope', [''])[0],
+                                          sub=q['code'][0])},
+            '/v2.6/oauth/access_token': lambda q: {
+                'access_token': self.token(q)},
+            '/v2.6/me': lambda q: {
+                'id': self.subject(q), 'name': 'Stub User', 'email': self.email},
+        }
+        self.server = None
+        self._keys = None
+        self._keys_lock = threading.Lock()
+
+    def token(self, params):
+        return 'stub-token.' + params['code'][0]
+
+    def subject(self, params):
+        # The account id is the code the token was issued for.
+        return params['access_token'][0].rpartition('.')[2]
+
+    @property
+    def keys(self):
+        with self._keys_lock:
+            if self._keys is None:
+                self._keys = rsa.newkeys(1024)
+            return self._keys
+
+    def jwks(self):
+        public_key = self.keys[0]
+        return {'keys': [{
+            'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': 'stub',
+            'n': b64encode(public_key.n.to_bytes((public_key.n.bit_length() + 7) // 8, 'big')),
+            'e': b64encode(public_key.e.to_bytes(3, 'big')),
+        }]}
+
+    def id_token(self, audience, scope='openid email profile', **claims):
+        now = int(time.time())
+        payload = {'sub': '1234', 'aud': audience,
+                   'iss': 'accounts.google.com', 'iat': now, 'exp': now + 3600}
+        # Like Google, only give the address if the email scope was asked for.
+        if 'email' in scope.split():
+            payload.update(email=self.email, email_verified=True)
+        payload.update(claims)
+        signing_input = (b64encode(json.dumps({'alg': 'RS256', 'kid': 'stub'}))
+                         + '.' + b64encode(json.dumps(payload)))
+        signature = rsa.sign(signing_input.encode('ascii'), self.keys[1], 'SHA-256')
+        return signing_input + '.' + b64encode(signature)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def provider_urls(self):
+        return dict.fromkeys(('github', 'github_api', 'google',
+                              'google_accounts', 'facebook'), self.url)
+
+    def start(self, port=0):
+        self.server = StubServer(('127.0.0.1', port), StubHandler)
+        self.server.stub = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,17 +1,20 @@
 import os
 import hashlib
 import requests
-import facebook
-import httplib2
-from django.http import HttpResponseRedirect, JsonResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare, get_random_string
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_protect
-from oauth2client import client
 from .forms import SigninForm, SignupForm, VerifyForm
-from .models import Member, VerifyEmail
+from .models import Member, SocialIdentity, VerifyEmail, email_key
 from .mail import send_verify_link, send_reset_password_link
+from .hashpool import HashPoolSaturated
+from .ratelimit import RateLimited
+from . import breaker, jwks, metrics, providers, ratelimit
 from sso.apps import SsoConfig
 
 
@@ -28,6 +31,34 @@ def main(request):
     return render(request, 'sso/main.html')
 
 
+def server_busy():
+    """
+    The response when password hashing is saturated (see hashpool.py).
+    """
+    response = HttpResponse('Too busy right now, please try again shortly.',
+                            content_type='text/plain', status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse('Too many attempts, please try again later.',
+                            content_type='text/plain', status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def metrics_view(request):
+    """
+    Serves the metrics in the Prometheus text format, to the addresses in
+    settings.SSO_METRICS_ALLOWED_IPS only.
+    """
+    if ratelimit.client_ip(request) not in settings.SSO_METRICS_ALLOWED_IPS:
+        return HttpResponse(status=404)
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_protect
 def signin(request):
     """
@@ -39,9 +70,21 @@ def signin(request):
     if request.method == 'POST':
         form = SigninForm(request.POST)
         if form.is_valid():
-            member = authenticate(email=form.cleaned_data['email'],
-                                  password=form.cleaned_data['password'])
+            email = form.cleaned_data['email']
+            # Rate limits are checked before authenticate() so that throttled
+            # attempts cost no hashing.  Only failures count against the email.
+            try:
+                ratelimit.check('signin-email', email)
+                ratelimit.limit('signin-ip', ratelimit.client_ip(request))
+            except RateLimited as e:
+                return too_many_requests(e.retry_after)
+            try:
+                member = authenticate(email=email,
+                                      password=form.cleaned_data['password'])
+            except HashPoolSaturated:
+                return server_busy()
             if member is None:
+                ratelimit.hit('signin-email', email)
                 form.add_error("password", "Email and password don't match.")
             elif not member.is_active:
                 form.add_error("email", "That account is disabled.")
@@ -53,10 +96,16 @@ def signin(request):
 
     # Depending on design requirements, the sign-in page can include either
     # a blank sign-up form or a link to the sign-up page.
+    return signin_page(request, form, SignupForm())
+
+
+def signin_page(request, signinform, signupform):
     return render(request, 'sso/signin.html',
                   {
-                      'signinform': form,
-                      'signupform': SignupForm(),
+                      'signinform': signinform,
+                      'signupform': signupform,
+                      'oauth_state': oauth_state(request),
+                      'google_scope': GOOGLE_SCOPE,
                       'github_client_id': SsoConfig.github_client_id,
                       'google_client_id': SsoConfig.google_client_id,
                       'facebook_client_id': SsoConfig.facebook_client_id
@@ -84,6 +133,11 @@ def signup(request):
         form = SignupForm(request.POST)
         if form.is_valid():
             email = form.cleaned_data['email']
+            try:
+                ratelimit.limit('signup-ip', ratelimit.client_ip(request))
+                ratelimit.limit('signup-email', email)
+            except RateLimited as e:
+                return too_many_requests(e.retry_after)
             if Member.objects.is_registered(email):
                 form.add_error("email", "That email address is already registered.")
             else:
@@ -93,8 +147,7 @@ def signup(request):
     else:
         form = SignupForm()
 
-    return render(request, 'sso/signin.html',
-                  {'signinform': SigninForm(), 'signupform': form})
+    return signin_page(request, SigninForm(), form)
 
 
 @csrf_protect
@@ -134,10 +187,25 @@ def verify(request):
             # create the member.
             args = form.cleaned_data.copy()
             args.pop('token')
-            Member.objects.create_user(**args)
-            member = authenticate(email=args['email'], password=args['password'])
-            # TODO: what if authenticate fails?
-            login(request, member)
+            # Creating and signing in the member is one transaction, so a
+            # failed login doesn't leave an account behind with the token
+            # already used up.
+            try:
+                with transaction.atomic():
+                    member = Member.objects.create_user(**args)
+                    VerifyEmail.remove(email)
+                    # We know the password is right, having just set it, so
+                    # log the new member in directly rather than
+                    # authenticate() them again, which would mean another
+                    # query and another password hash.
+                    member.backend = settings.AUTHENTICATION_BACKENDS[0]
+                    login(request, member)
+            except HashPoolSaturated:
+                return server_busy()
+            except IntegrityError:
+                # Lost a race with another tab submitting the same form.
+                return render(request, 'sso/verifysorry.html',
+                              {'email': email, 'code': 'duplicate'})
             return HttpResponseRedirect('/welcome')
     else:
         form = VerifyForm(initial={'email': email, 'token': token})
@@ -150,44 +218,194 @@ def welcome(request):
     return render(request, 'sso/welcome.html')
 
 
-def request_access_token(url, payload):
+def request_access_token(provider, url, payload):
     headers = {
         'Accept': 'application/json'
     }
-    r = requests.post(url, data=payload, headers=headers)
+    r = providers.post(provider, url, data=payload, headers=headers)
     return r.json()
 
 
+def provider_unavailable(error=None):
+    """
+    The response when a provider can't be reached.  While its circuit is
+    open (see breaker.py) that's known without trying, so the member is
+    told straight away when to try again, or to use their password.
+    """
+    if isinstance(error, breaker.CircuitOpen):
+        response = JsonResponse({'error': 'Provider unavailable',
+                                 'retry_after': error.retry_after,
+                                 'fallback': '/signin'}, status=503)
+        response['Retry-After'] = str(error.retry_after)
+        return response
+    return JsonResponse({'error': 'Provider unavailable'}, status=502)
+
+
+# The session key for the OAuth state parameter, which ties a provider
+# callback to the browser that started the sign-in.
+OAUTH_STATE_KEY = 'sso_oauth_state'
+
+
+def oauth_state(request):
+    """
+    Returns this session's OAuth state, to go in the links to the providers.
+    """
+    state = request.session.get(OAUTH_STATE_KEY)
+    if state is None:
+        state = request.session[OAUTH_STATE_KEY] = get_random_string(32)
+    return state
+
+
+def valid_oauth_state(request):
+    """
+    Returns True if the callback's state parameter is this session's.
+    Without it, anyone could get a signed-in member to load a callback with
+    the attacker's code, linking the attacker's account to the member's.
+    """
+    expected = request.session.get(OAUTH_STATE_KEY)
+    return expected is not None and constant_time_compare(
+        request.GET.get('state', ''), expected)
+
+
+def invalid_oauth_state():
+    return JsonResponse({'error': 'Invalid state'}, status=400)
+
+
+def provider_result(request, fetch, code):
+    """
+    Returns fetch(code), the result of talking to the provider, unless the
+    ASGI handler (sso/asgi.py) has already fetched it asynchronously and
+    passed it along with the request.
+    """
+    if 'sso.provider_result' in request.META:
+        return request.META['sso.provider_result']
+    return fetch(code)
+
+
+def identity(subject, email='', email_verified=False, name='', **extra):
+    """
+    What the fetch_*_identity() functions return: the provider's id for the
+    account, plus what it says about the email address and name.
+    """
+    return dict(extra, subject=str(subject), email=email or '',
+                email_verified=bool(email and email_verified), name=name or '')
+
+
+def social_signin(request, provider, identity, verified_email=None):
+    """
+    Signs in the member linked to the provider account in identity.  An
+    account seen for the first time is linked to the signed-in member, or
+    else to the member with the provider's verified email address (who is
+    created if need be).  verified_email(identity) is called to look the
+    address up if identity doesn't have a verified one, which only new
+    accounts need.  The callback's state must have been checked first.
+    """
+    member = SocialIdentity.member_for(provider, identity['subject'])
+    if member is None:
+        member = link_identity(request, provider, identity, verified_email)
+        if member is None:
+            return JsonResponse({'error': 'No verified email address'}, status=400)
+    if not member.is_active:
+        return JsonResponse({'error': 'Account disabled'}, status=403)
+
+    # The provider has vouched for them, so there's no password to check.
+    member.backend = settings.AUTHENTICATION_BACKENDS[0]
+    login(request, member)
+    return HttpResponseRedirect('/welcome')
+
+
+def link_identity(request, provider, identity, verified_email=None):
+    """
+    Links a provider account to a member; see social_signin().  Returns
+    the member, or None if there's no member to link to.
+    """
+    member = request.user if request.user.is_authenticated() else None
+    email = identity['email'] if identity['email_verified'] else ''
+    if member is None:
+        if not email and verified_email is not None:
+            email = verified_email(identity)
+        if not email:
+            return None
+        member = Member.objects.filter(email_key=email_key(email)).first()
+
+    try:
+        with transaction.atomic():
+            if member is None:
+                member = Member.objects.create_user(
+                    email, short_name=(identity['name'] or email.split('@')[0])[:32])
+            SocialIdentity.link(member, provider, identity['subject'], email)
+    except IntegrityError:
+        # Lost a race with another callback for the same account.
+        return SocialIdentity.member_for(provider, identity['subject'])
+    return member
+
+
 ######################################
 # Github related code
 ######################################
+def github_token_payload(code):
+    return {
+        'client_id': SsoConfig.github_client_id,
+        'client_secret': SsoConfig.github_client_secret,
+        'code': code,
+    }
+
+
 def auth_with_github(request):
     code = request.GET.get('code', '')
     if code is not '':
-        payload = {
-            'client_id': SsoConfig.github_client_id,
-            'client_secret': SsoConfig.github_client_secret,
-            'code': code,
-        }
-        json_resp = request_access_token('https://github.com/login/oauth/access_token', payload)
-        token = json_resp['access_token']
-        scopes = json_resp['scope'].split(',')
-
-        primary_email = get_github_primary_user_email(token)
-        return JsonResponse({'result': primary_email})
+        if not valid_oauth_state(request):
+            return invalid_oauth_state()
+        try:
+            user = provider_result(request, fetch_github_identity, code)
+            return social_signin(request, 'github', user, github_verified_email)
+        except requests.RequestException as e:
+            return provider_unavailable(e)
     else:
         return JsonResponse({'error': 'Error'})
 
 
+def fetch_github_identity(code):
+    json_resp = request_access_token(
+        'github',
+        providers.provider_url('github', '/login/oauth/access_token'),
+        github_token_payload(code)
+    )
+    token = json_resp['access_token']
+
+    r = providers.get('github',
+                      providers.provider_url('github_api', '/user'),
+                      params={
+                          'access_token': token
+                      })
+    return github_identity(r.json(), token)
+
+
+def github_identity(user, token):
+    # The profile email is whatever the user chose to make public, and
+    # isn't necessarily verified; github_verified_email() asks for that.
+    # The token is kept for it, but never stored.
+    return identity(user['id'], user.get('email'), False,
+                    user.get('name') or user.get('login'), access_token=token)
+
+
+def github_verified_email(identity):
+    return get_github_primary_user_email(identity['access_token'])
+
+
 def get_github_primary_user_email(token):
-    r = requests.get('https://api.github.com/user/emails',
-                     params={
-                         'access_token': token
-                     })
-    user_email_list = r.json()
+    r = providers.get('github',
+                      providers.provider_url('github_api', '/user/emails'),
+                      params={
+                          'access_token': token
+                      })
+    return github_primary_email(r.json())
+
+
+def github_primary_email(user_email_list):
     primary_email = ''
     for email_info in user_email_list:
-        if email_info.get('primary', ''):
+        if email_info.get('primary', '') and email_info.get('verified', ''):
             return email_info['email']
 
     return primary_email
@@ -196,49 +414,107 @@ def get_github_primary_user_email(token):
 ######################################
 # Google related code
 ######################################
+GOOGLE_REDIRECT_URI = 'http://localhost:8000/callback/google'
+# Without email, the ID token has no address to find or create a member by.
+GOOGLE_SCOPE = 'openid email profile'
+
+
 def auth_with_google(request):
     code = request.GET.get('code', '')
     if code is not '':
-        credentials = client.credentials_from_code(
-            SsoConfig.google_client_id,
-            SsoConfig.google_client_secret,
-            'profile',
-            code,
-            redirect_uri='http://localhost:8000/callback/google'
-        )
-        return JsonResponse(credentials.id_token)
+        if not valid_oauth_state(request):
+            return invalid_oauth_state()
+        try:
+            user = provider_result(request, fetch_google_identity, code)
+        except requests.RequestException as e:
+            return provider_unavailable(e)
+        except jwks.InvalidIdToken:
+            return JsonResponse({'error': 'Invalid ID token'}, status=400)
+        except (ValueError, KeyError):
+            # A discovery, key or token response that isn't the JSON
+            # expected, as the ASGI handler treats it too.
+            return provider_unavailable()
+        return social_signin(request, 'google', user)
     else:
         return JsonResponse({'error': 'Error'})
 
 
+def google_token_payload(code):
+    return {
+        'grant_type': 'authorization_code',
+        'client_id': SsoConfig.google_client_id,
+        'client_secret': SsoConfig.google_client_secret,
+        'code': code,
+        'redirect_uri': GOOGLE_REDIRECT_URI,
+        'scope': GOOGLE_SCOPE,
+    }
+
+
+def verify_google_id_token(id_token):
+    # The signing keys are cached (see sso/jwks.py), so this normally makes
+    # no network calls.
+    return jwks.verify_id_token(id_token, SsoConfig.google_client_id,
+                                jwks.google_keys)
+
+
+def google_identity(claims):
+    return identity(claims['sub'], claims.get('email'),
+                    claims.get('email_verified'), claims.get('name'))
+
+
+def fetch_google_identity(code):
+    # Everything needed is in the ID token, so this is the only call.
+    json_resp = request_access_token('google', jwks.google_token_endpoint(),
+                                     google_token_payload(code))
+    return google_identity(verify_google_id_token(json_resp['id_token']))
+
+
 ######################################
 # Facebook related code
 ######################################
+def facebook_token_payload(code):
+    return {
+        'client_id': SsoConfig.facebook_client_id,
+        'client_secret': SsoConfig.facebook_client_secret,
+        'code': code,
+        'redirect_uri': 'http://localhost:8000/callback/facebook',
+    }
+
+
+# This is the same request facebook.GraphAPI.get_object('me') would make.
+FACEBOOK_PROFILE_FIELDS = 'id,name,email'
+
+
 def auth_with_facebook(request):
     code = request.GET.get('code', '')
     if code is not '':
-        payload = {
-            'client_id': SsoConfig.facebook_client_id,
-            'client_secret': SsoConfig.facebook_client_secret,
-            'code': code,
-            'redirect_uri': 'http://localhost:8000/callback/facebook',
-        }
-        json_resp = request_access_token(
-            'https://graph.facebook.com/v2.6/oauth/access_token',
-            payload
-        )
-
-        token = json_resp['access_token']
-        graph = facebook.GraphAPI(access_token=token)
-        args = {'fields': 'id,name,email', }
-        profile = graph.get_object(id='me', **args)
-
-        return JsonResponse(profile)
-        #scopes = json_resp['scope'].split(',')
-
-        #primary_email = get_github_primary_user_email(token)
-        #return JsonResponse({'result': primary_email})
+        if not valid_oauth_state(request):
+            return invalid_oauth_state()
+        try:
+            user = provider_result(request, fetch_facebook_identity, code)
+        except requests.RequestException as e:
+            return provider_unavailable(e)
+        return social_signin(request, 'facebook', user)
     else:
         return JsonResponse({'error': 'Error'})
 
 
+def facebook_identity(profile):
+    # The Graph API only returns an email address once it's been confirmed.
+    return identity(profile['id'], profile.get('email'), True, profile.get('name'))
+
+
+def fetch_facebook_identity(code):
+    json_resp = request_access_token(
+        'facebook',
+        providers.provider_url('facebook', '/v2.6/oauth/access_token'),
+        facebook_token_payload(code)
+    )
+
+    token = json_resp['access_token']
+    args = {'fields': FACEBOOK_PROFILE_FIELDS, 'access_token': token}
+    return facebook_identity(providers.get(
+        'facebook',
+        providers.provider_url('facebook', '/v2.6/me'),
+        params=args
+    ).json())